@@ -0,0 +1,303 @@
+# Микробенчмарки горячих примитивов: сборка, разбор и отправка пакетов
+#
+# python bench_primitives.py                          - замер и вывод
+# python bench_primitives.py --save-baseline          - сохранить базовые результаты
+# python bench_primitives.py --compare --threshold 0.25
+#                                                     - выход с кодом 1, если примитив
+#                                                       стал медленнее базы больше чем на 25%
+
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import sys
+import timeit
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'bench_baseline.json')
+
+MAC = '0A-1B-2C-3D-4E-5F'
+FOREIGN_MAC = '0A-1B-2C-3D-4E-60'
+# Сколько датаграмм в одном прогоне потока смешанного трафика
+STREAM_SIZE = 256
+
+
+def agent_stream(rng: random.Random) -> list:
+    """
+    Трафик на порту агента: свои команды (в том числе с подтверждением),
+    команды и WoL для других ПК, heartbeat'ы, обрезанные и случайные пакеты
+    """
+    import wol
+    from heartbeat import encode_heartbeat
+
+    own = [wol.build_packet(MAC, wol.COMMAND_OFF), wol.build_packet(MAC, wol.COMMAND_SLEEP)]
+    acked = [packet + rng.getrandbits(32).to_bytes(4, 'big') for packet in own]
+    foreign = [wol.build_packet(FOREIGN_MAC, command) for command in (wol.COMMAND_WOL, wol.COMMAND_OFF)]
+    malformed = [
+        own[0][:50],
+        own[0] + b'\x00',
+        encode_heartbeat(wol.mac_to_bytes(MAC), 1_700_000_000, 1),
+        bytes(rng.getrandbits(8) for _ in range(102)),
+        b'',
+    ]
+    # Большая часть трафика в широковещательном домене - чужая
+    kinds = [(own, 1), (acked, 1), (foreign, 6), (malformed, 2)]
+    population = [packets for packets, weight in kinds for _ in range(weight)]
+    return [rng.choice(rng.choice(population)) for _ in range(STREAM_SIZE)]
+
+
+def bot_stream(rng: random.Random) -> list:
+    """
+    Трафик на порту бота: бинарные heartbeat'ы и уведомления, старый JSON,
+    чужие и битые пакеты
+    """
+    import wol
+    from heartbeat import encode_heartbeat, KIND_SHUTDOWN, HEARTBEAT_SIZE
+
+    macs = [bytes([0x02, 0, 0, 0, 0, index]) for index in range(16)]
+    binary = [encode_heartbeat(mac, 1_700_000_000 + index, index) for index, mac in enumerate(macs)]
+    notices = [encode_heartbeat(mac, 1_700_000_000, 1, KIND_SHUTDOWN) for mac in macs[:2]]
+    legacy = [
+        json.dumps({'sender_mac': mac.hex('-').upper(), 'uptime_seconds': 3600 + index,
+                    'boot_time': 1_700_000_000, 'formatted_uptime': '0d 1h 0m 0s'}).encode()
+        for index, mac in enumerate(macs[:4])
+    ]
+    legacy.append(json.dumps({'sender_mac': MAC, 'uptime_seconds': 60, 'event': 'shutdown'}).encode())
+    malformed = [
+        b'{"sender_mac": "0A-1B',
+        b'{"broken": }',
+        b'[1, 2, 3]',
+        b'PL\x02\x00' + bytes(HEARTBEAT_SIZE - 4),
+        binary[0][:HEARTBEAT_SIZE - 1],
+        wol.build_packet(MAC, wol.COMMAND_WOL),
+        bytes(rng.getrandbits(8) for _ in range(64)),
+    ]
+    kinds = [(binary, 12), (notices, 1), (legacy, 4), (malformed, 3)]
+    population = [packets for packets, weight in kinds for _ in range(weight)]
+    return [rng.choice(rng.choice(population)) for _ in range(STREAM_SIZE)]
+
+
+def loopback_pair():
+    """Неблокирующий UDP-приемник на loopback и адрес для отправки в него"""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.setblocking(False)
+    return receiver, receiver.getsockname()
+
+
+def drain(sock: socket.socket):
+    while True:
+        try:
+            sock.recv(2048)
+        except BlockingIOError:
+            return
+
+
+def build_benchmarks(rng: random.Random) -> tuple:
+    """
+    Собирает бенчмарки
+
+    Returns:
+        tuple: ({имя: (функция без аргументов, сколько операций в одном вызове)},
+                [сокеты и отправители, которые нужно закрыть])
+    """
+    import pc
+    import wol
+    from heartbeat import encode_heartbeat, decode_binary, from_json
+    from listen_time import HeartbeatListener
+    from udp_io import DatagramReceiver
+
+    benchmarks = {}
+    closing = []
+
+    # Агент: сборка и проверка командных пакетов
+    off_packet = pc.assemble_off_packet(MAC)
+    foreign_packet = wol.build_packet(FOREIGN_MAC, wol.COMMAND_OFF)
+    packet_table = pc.build_packet_table(MAC)
+    benchmarks['pc.assemble_off_packet'] = (lambda: pc.assemble_off_packet(MAC), 1)
+    benchmarks['pc.assemble_sleep_packet'] = (lambda: pc.assemble_sleep_packet(MAC), 1)
+    benchmarks['pc.check_is_wol_packet match'] = (lambda: pc.check_is_wol_packet(off_packet, off_packet), 1)
+    benchmarks['pc.check_is_wol_packet foreign'] = (lambda: pc.check_is_wol_packet(foreign_packet, off_packet), 1)
+    benchmarks['pc.classify_packet own'] = (lambda: pc.classify_packet(off_packet, packet_table), 1)
+    benchmarks['pc.classify_packet foreign'] = (lambda: pc.classify_packet(foreign_packet, packet_table), 1)
+
+    agent_packets = [memoryview(packet) for packet in agent_stream(rng)]
+
+    def classify_stream():
+        for view in agent_packets:
+            if pc.classify_packet(view, packet_table) is not None:
+                pc.command_id(view)
+
+    benchmarks['pc.classify_packet mixed stream'] = (classify_stream, len(agent_packets))
+
+    # Агент: heartbeat'ы
+    pc.get_boot_time()
+    benchmarks['pc.get_system_uptime'] = (pc.get_system_uptime, 1)
+    benchmarks['pc.build_time_message binary'] = (lambda: pc.build_time_message(MAC), 1)
+
+    # Бот: сборка командных пакетов и отправка
+    benchmarks['wol.build_packet'] = (lambda: wol.build_packet(MAC, wol.COMMAND_OFF), 1)
+    sender = wol.WolSender()
+    closing.append(sender)
+    benchmarks['wol.WolSender.packet cached'] = (lambda: sender.packet(MAC, wol.COMMAND_OFF), 1)
+
+    sink, (host, port) = loopback_pair()
+    closing.append(sink)
+    loopback_sender = wol.WolSender(port)
+    closing.append(loopback_sender)
+
+    def send_batch():
+        for _ in range(64):
+            loopback_sender.send(MAC, wol.COMMAND_OFF, host)
+        drain(sink)
+
+    benchmarks['wol.WolSender.send loopback'] = (send_batch, 64)
+
+    # Бот: разбор heartbeat'ов
+    mac_bytes = wol.mac_to_bytes(MAC)
+    heartbeat = encode_heartbeat(mac_bytes, 1_700_000_000, 42)
+    legacy = json.dumps({'sender_mac': MAC, 'uptime_seconds': 3600, 'boot_time': 1_700_000_000}).encode()
+    benchmarks['heartbeat.encode_heartbeat'] = (lambda: encode_heartbeat(mac_bytes, 1_700_000_000, 42), 1)
+    benchmarks['heartbeat.decode_binary'] = (lambda: decode_binary(memoryview(heartbeat)), 1)
+    benchmarks['heartbeat.from_json'] = (lambda: from_json(json.loads(legacy)), 1)
+
+    # Очередь бота не измеряется: разобранные пакеты сразу выбрасываются
+    listener = HeartbeatListener(types.SimpleNamespace(put_nowait=collections.deque(maxlen=1).append))
+    bot_packets = [memoryview(packet) for packet in bot_stream(rng)]
+    addr = ('127.0.0.1', 40000)
+
+    def parse_stream():
+        for view in bot_packets:
+            listener._handle(view, addr)
+
+    benchmarks['listen_time._handle mixed stream'] = (parse_stream, len(bot_packets))
+
+    # Полный путь приема: sendto -> recvfrom_into -> разбор, как в цикле слушателя
+    bot_sock, bot_addr = loopback_pair()
+    agent_sock, agent_addr = loopback_pair()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    closing.extend((bot_sock, agent_sock, client))
+    raw_bot_packets = [view.tobytes() for view in bot_packets]
+    raw_agent_packets = [view.tobytes() for view in agent_packets]
+    bot_receiver = DatagramReceiver()
+    agent_receiver = DatagramReceiver(pc.ACKED_PACKET_SIZE)
+
+    def bot_receive():
+        for packet in raw_bot_packets:
+            client.sendto(packet, bot_addr)
+        bot_receiver.drain(bot_sock, listener._handle)
+
+    def agent_receive():
+        for packet in raw_agent_packets:
+            client.sendto(packet, agent_addr)
+        agent_receiver.drain(agent_sock, lambda view, addr: pc.classify_packet(view, packet_table) is not None)
+
+    benchmarks['bot receive mixed stream'] = (bot_receive, len(raw_bot_packets))
+    benchmarks['agent receive mixed stream'] = (agent_receive, len(raw_agent_packets))
+    return benchmarks, closing
+
+
+def measure(function, operations: int, repeat: int, min_time: float) -> float:
+    """
+    Замеряет функцию через timeit
+
+    Returns:
+        float: Лучшее время одной операции в наносекундах
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / elapsed))
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number / operations * 1e9
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Сравнивает результаты с базовыми
+
+    Returns:
+        list: [(имя, база нс, сейчас нс, отношение)] для примитивов, ставших
+              медленнее больше чем на threshold
+    """
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = current / base
+        if ratio > 1 + threshold:
+            regressions.append((name, base, current, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Микробенчмарки сборки, разбора и отправки пакетов')
+    parser.add_argument('--filter', help='Запускать только бенчмарки, в имени которых есть эта строка')
+    parser.add_argument('--repeat', type=int, default=5, help='Сколько повторов замера (берется лучший)')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Минимальная длительность одного повтора, с')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Файл базовых результатов')
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить результаты как базовые')
+    parser.add_argument('--compare', action='store_true', help='Сравнить с базовыми результатами')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Допустимое замедление относительно базы (0.25 - на 25%%)')
+    parser.add_argument('--seed', type=int, default=1, help='Зерно генератора смешанного трафика')
+    args = parser.parse_args(argv)
+
+    # listen_time читает PORT при импорте; порт для бенчмарков не открывается
+    os.environ.setdefault('PORT', '0')
+    sys.path.insert(0, HERE)
+    # Битые JSON-пакеты логируются; в замер попадает проверка уровня, но не вывод
+    logging.disable(logging.CRITICAL)
+
+    benchmarks, closing = build_benchmarks(random.Random(args.seed))
+    results = {}
+    try:
+        for name, (function, operations) in benchmarks.items():
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(function, operations, args.repeat, args.min_time)
+            print(f'{name:40} {results[name]:10.1f} нс/оп')
+    finally:
+        for resource in closing:
+            resource.close()
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f).get('results', {})
+        # С --filter обновляются только замеренные примитивы
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': baseline,
+            }, f, ensure_ascii=False, indent=2)
+        print(f'\nБазовые результаты сохранены в {args.baseline}')
+
+    if args.compare:
+        if not os.path.isfile(args.baseline):
+            parser.error(f'Нет файла базовых результатов {args.baseline}, сначала запустите с --save-baseline')
+        with open(args.baseline, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('python') != platform.python_version():
+            print(f"\nВнимание: база снята на Python {saved.get('python')}, сейчас {platform.python_version()}")
+        regressions = compare(results, saved.get('results', {}), args.threshold)
+        if regressions:
+            print(f'\nЗамедление больше чем на {args.threshold:.0%}:')
+            for name, base, current, ratio in regressions:
+                print(f'  {name:40} {base:10.1f} -> {current:10.1f} нс/оп (x{ratio:.2f})')
+            sys.exit(1)
+        print(f'\nРегрессий нет (порог {args.threshold:.0%})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# Бенчмарк запуска агента: время импорта (-X importtime) и время до первого heartbeat'а
+#
+# python bench_startup.py              - агент (pc)
+# python bench_startup.py --module bot - импорт бота (нужен заполненный .env)
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from pc import TIME_PORT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LOOPBACK_INTERFACE = 'lo0' if sys.platform == 'darwin' else 'lo'
+
+
+def run_importtime(module: str, env: dict) -> list:
+    """
+    Импортирует модуль в отдельном процессе с -X importtime
+
+    Returns:
+        list: [(self_us, cumulative_us, имя модуля)] для каждого импорта
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=HERE, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Импорт {module} завершился с ошибкой:\n{result.stderr[-2000:]}')
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return imports
+
+
+def measure_first_heartbeat(env: dict, timeout: float = 5.0) -> float:
+    """
+    Запускает основной цикл агента (pc.run_agent) на loopback-интерфейсе
+    с BROADCAST_IP=127.0.0.1 и измеряет время от запуска процесса до
+    получения первого heartbeat'а на TIME_PORT
+
+    Returns:
+        float: Время до первого heartbeat'а в секундах
+    """
+    # Без INTERFACE_ADDRESS агент пропускает 127.0.0.1
+    env = dict(env, BROADCAST_IP='127.0.0.1', INTERFACE_NAME=LOOPBACK_INTERFACE, INTERFACE_ADDRESS='127.0.0.1')
+    # Командный порт 0 вместо WOL_PORT: порт 9 привилегированный, а в остальном
+    # это тот же путь запуска, что и pc.main()
+    code = 'import pc; pc.run_agent(pc.INTERFACE_NAME, 0)'
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.bind(('127.0.0.1', TIME_PORT))
+        except OSError as e:
+            raise RuntimeError(f'Порт {TIME_PORT} занят (запущен бот?): {e}') from None
+        sock.settimeout(timeout)
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', code], cwd=HERE, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        try:
+            sock.recvfrom(2048)
+            latency = time.perf_counter() - started
+        except socket.timeout:
+            latency = None
+        process.terminate()
+        errors = process.communicate()[1]
+    if latency is None:
+        raise RuntimeError(f'Агент не отправил heartbeat за {timeout:.0f} с:\n{errors[-2000:]}')
+    return latency
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк запуска агента и бота')
+    parser.add_argument('--module', default='pc', help='Какой модуль импортировать (pc, bot, ...)')
+    parser.add_argument('--runs', type=int, default=5, help='Сколько раз повторить замер')
+    parser.add_argument('--top', type=int, default=15, help='Сколько самых медленных импортов показать')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.setdefault('PORT', '55543')
+
+    totals = []
+    imports = []
+    for _ in range(args.runs):
+        imports = run_importtime(args.module, env)
+        totals.append(next(cumulative for _, cumulative, name in imports if name.strip() == args.module))
+    print(f'Импорт {args.module}: медиана {statistics.median(totals) / 1000:.1f} мс '
+          f'(мин {min(totals) / 1000:.1f} мс, {args.runs} запусков)')
+
+    print(f'\nСамые медленные импорты (накопительно, последний запуск):')
+    for self_us, cumulative_us, name in sorted(imports, key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'  {cumulative_us / 1000:8.1f} мс  (собственное {self_us / 1000:6.1f} мс)  {name}')
+
+    heavy = [name for name in ('psutil', 'json', 'subprocess', 'dotenv', 'telegram')
+             if any(imported.strip() == name for _, _, imported in imports)]
+    print(f'\nТяжелые модули, загруженные при импорте: {", ".join(heavy) or "нет"}')
+
+    if args.module == 'pc':
+        latencies = [measure_first_heartbeat(env) for _ in range(args.runs)]
+        print(f'\nОт запуска процесса до первого heartbeat\'а: медиана '
+              f'{statistics.median(latencies) * 1000:.1f} мс (мин {min(latencies) * 1000:.1f} мс)')
+
+
+if __name__ == '__main__':
+    main()
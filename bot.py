@@ -1,17 +1,20 @@
 import os 
+import re
 from dotenv import load_dotenv
 import asyncio
 import time
-import json
 import logging
+from logging_setup import setup_logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
+load_dotenv()
+
+# Запись в файл идет в отдельном потоке: остановка диска не блокирует цикл событий
+log_listener = setup_logging(
+    os.getenv('LOG_FILE', 'bot.log'),
+    fmt=os.getenv('LOG_FORMAT', 'text'),
+    max_bytes=int(os.getenv('LOG_MAX_BYTES', 5 * 1024 * 1024)),
+    backup_count=int(os.getenv('LOG_BACKUP_COUNT', 5)),
+    rate_burst=int(os.getenv('LOG_RATE_BURST', 10)),
 )
 logger = logging.getLogger(__name__)
 
@@ -25,21 +28,63 @@ for noisy_logger in [
 ]:
     logging.getLogger(noisy_logger).setLevel(logging.WARNING)
 
-from wol import send_wol, send_off, send_sleep
-from telegram import InlineKeyboardButton, Update, InlineKeyboardMarkup
-from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes
-from listen_time import run_udp_port_listener_time
-
-
-load_dotenv()
-
 pc_mac_address = os.getenv("PC_MAC_ADDRESS")
 broadcast_ip = os.getenv("BROADCAST_IP")
 telegram_bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
 users_env = os.getenv("USERS")
 
+# Проверяем окружение до импорта стека telegram: ошибка конфигурации видна сразу
+missing_env = [name for name in ('TELEGRAM_BOT_TOKEN', 'PORT', 'USERS') if not os.getenv(name)]
+if missing_env:
+    raise ValueError(f"Не установлены переменные окружения: {', '.join(missing_env)}")
+
 PORT = int(os.getenv('PORT'))
-ETHERNET = os.getenv('ETHERNET')
+# Сколько секунд ПК может молчать, прежде чем считается выключенным, пока
+# детектор еще не выучил интервалы его heartbeat'ов
+PC_TIMEOUT = float(os.getenv('PC_TIMEOUT', 10))
+# Порог подозрения phi: ПК выключен, когда вероятность такой паузы меньше 10^-phi
+PC_PHI_THRESHOLD = float(os.getenv('PC_PHI_THRESHOLD', 8))
+# Сколько последних интервалов между heartbeat'ами помнить для каждого ПК
+PC_LIVENESS_WINDOW = int(os.getenv('PC_LIVENESS_WINDOW', 50))
+# Шаг отображения времени работы в секундах: при 60 текст меняется раз в минуту
+UPTIME_RESOLUTION = int(os.getenv('UPTIME_RESOLUTION', 60))
+# Сколько секунд ждать первого heartbeat'а после команды включения
+WAKE_TIMEOUT = float(os.getenv('WAKE_TIMEOUT', 300))
+# Команды выключения и сна с подтверждением от агента (агент должен быть новой версии)
+COMMAND_ACK = os.getenv('COMMAND_ACK', '0').lower() in ('1', 'true', 'yes')
+# Сколько секунд повторять команду, пока агент не подтвердит ее
+COMMAND_ACK_TIMEOUT = float(os.getenv('COMMAND_ACK_TIMEOUT', 3))
+# Файл SQLite с сообщениями статуса пользователей (переживает перезапуск бота)
+SESSION_DB = os.getenv('SESSION_DB', 'sessions.db')
+# Файл SQLite с историей включений ПК (сводки по часам и дням для /history)
+HISTORY_DB = os.getenv('HISTORY_DB', 'history.db')
+# Список MAC-адресов управляемых ПК через запятую: heartbeat'ы других ПК
+# отбрасываются. Без списка ПК заводятся по heartbeat'ам, но не больше MAX_PCS
+PC_MAC_ADDRESSES = [mac.strip() for mac in os.getenv('PC_MAC_ADDRESSES', '').split(',') if mac.strip()]
+MAX_PCS = int(os.getenv('MAX_PCS', 256))
+
+# Способ получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+# Публичный адрес, на который Telegram шлет обновления (без пути)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Где слушает локальный сервер webhook'а (обычно за reverse proxy)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Сертификат и ключ, если TLS завершается в самом боте
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY')
+
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling или webhook)")
+if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+    raise ValueError("Для BOT_MODE=webhook нужна переменная окружения WEBHOOK_URL")
+# Без секрета кто угодно может прислать на WEBHOOK_URL нажатие кнопки от имени пользователя
+if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+    raise ValueError("Для BOT_MODE=webhook нужна переменная окружения WEBHOOK_SECRET")
+if WEBHOOK_SECRET and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', WEBHOOK_SECRET):
+    raise ValueError("WEBHOOK_SECRET: от 1 до 256 символов A-Z, a-z, 0-9, _ и -")
 
 ALLOWED_USERS = []
 users_env = str(users_env)[1:-1]
@@ -47,6 +92,30 @@ users_env = users_env.split(',')
 for i in users_env:
     ALLOWED_USERS.append(int(i))
 
+# Кому доступна команда /stats (по умолчанию - всем из USERS)
+admins_env = os.getenv('ADMIN_USERS')
+ADMIN_USERS = [int(i) for i in admins_env.strip('[]').split(',')] if admins_env else ALLOWED_USERS
+# Порт локального эндпоинта метрик в формате Prometheus (0 - выключен)
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+from wol import WolSender, COMMAND_WOL, COMMAND_OFF, COMMAND_SLEEP
+from wake import WakeTracker
+from telegram import InlineKeyboardButton, Update, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes
+from listen_time import start_time_listener
+from udp_io import use_selector_event_loop
+from fleet import FleetRegistry, StatusView, MESSAGE_LIMIT, STATUS_ON, STATUS_OFF, STATUS_SLEEP, format_uptime
+from heartbeat import KIND_HEARTBEAT, KIND_SHUTDOWN, KIND_SLEEP
+from deadlines import DeadlineScheduler
+from liveness import LivenessTracker
+from notify import EditDispatcher, RenderCache, PRIORITY_TRANSITION, PRIORITY_REFRESH
+from session_store import SessionStore
+from history import HistoryStore, DAY, day_start
+from metrics import MetricsRegistry, LAG_BUCKETS, timed, monitor_loop_lag, start_metrics_server
+
 print(f"Разрешенные пользователи: {ALLOWED_USERS}")
 logger.info(f"Разрешенные пользователи: {ALLOWED_USERS}")
 
@@ -55,140 +124,642 @@ logger.info(f"Разрешенные пользователи: {ALLOWED_USERS}")
 button_PC_control_data =    [[InlineKeyboardButton("🚀 turn on", callback_data="turn_on")], 
                             [InlineKeyboardButton("⚫️ turn off", callback_data="turn_off")],
                             [InlineKeyboardButton("🛏️ sleep", callback_data="sleep")]]
+# Клавиатура не меняется, собираем ее один раз
+PC_control_markup = InlineKeyboardMarkup(button_PC_control_data)
+
+# Сообщения со статусом активных пользователей (кто запускал /start или нажимал кнопки):
+# user_id -> (chat_id, message_id), хранятся в SQLite и загружаются в post_init
+sessions = SessionStore(SESSION_DB)
+
+# Ошибки Telegram, после которых править сообщение пользователя бесполезно
+GONE_ERRORS = ('chat not found', 'message to edit not found', 'message not found')
+
+# Бот для запросов вне обработчиков (задается в post_init)
+telegram_bot = None
+
+# Постоянный UDP-слушатель времени (создается в post_init)
+heartbeat_listener = None
+
+# Дедлайны выключения ПК по таймауту (создается в post_init)
+offline_deadlines = None
+
+# Параллельная рассылка обновлений с лимитами Telegram (создается в post_init)
+notifier = None
+
+# Последний отправленный каждому пользователю текст статуса
+render_cache = RenderCache()
+
+# Постоянный broadcast-сокет для команд ПК (создается в post_init)
+wol_sender = None
 
-# Для хранения активных пользователей (кто запускал /start или нажимал кнопки)
-active_users = {}
+# Адаптивные таймауты ПК по интервалам их heartbeat'ов
+# PC_TIMEOUT - и таймаут до накопления интервалов, и нижняя граница выученного
+liveness = LivenessTracker(PC_PHI_THRESHOLD, window=PC_LIVENESS_WINDOW, fallback_timeout=PC_TIMEOUT,
+                           min_timeout=PC_TIMEOUT)
 
-# Глобальный статус ПК
-PC_status = '⚫️ Выключен'
-last_packet_time = 0
+# Задержки включения ПК: от команды WOL до первого heartbeat'а
+wake_tracker = WakeTracker()
+
+# История включений ПК: последние замеры в памяти, сводки в SQLite. Время
+# работы засчитывается, пока ПК включен в реестре: каждое выключение (по
+# уведомлению или по таймауту детектора) записывается в notify_pc_offline
+pc_history = HistoryStore(HISTORY_DB)
+
+# Реестр ПК по MAC-адресу (статус, время последнего пакета, время работы, IP)
+if PC_MAC_ADDRESSES and pc_mac_address:
+    PC_MAC_ADDRESSES.append(pc_mac_address)
+fleet = FleetRegistry(PC_MAC_ADDRESSES, MAX_PCS)
+if pc_mac_address:
+    fleet.get_or_create(pc_mac_address)
+
+# Текст статуса: перерисовывается только блок ПК, от которого пришел пакет,
+# при большом парке - сводка в пределах лимита Telegram
+status_view = StatusView(fleet, UPTIME_RESOLUTION)
+
+# Задержка цикла событий, время обработчиков и задач, счетчики по ПК
+bot_metrics = MetricsRegistry()
+loop_lag = bot_metrics.histogram('loop_lag_seconds', bounds=LAG_BUCKETS)
+
+# Локальный HTTP-эндпоинт метрик (создается в post_init, если задан METRICS_PORT)
+metrics_server = None
+
+# Фоновые задачи обработчиков (ожидание включения ПК, повтор команд). Они не
+# создаются через Application.create_task: Application.stop() ждал бы их до
+# WAKE_TIMEOUT, поэтому они отменяются в post_stop
+background_tasks = set()
+
+def start_background(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background)
+    return task
+
+def finish_background(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Ошибка фоновой задачи: {task.exception()!r}", exc_info=task.exception())
 
 def is_user_authorized(user_id: int) -> bool:
     """Проверяет, авторизован ли пользователь."""
-    logger.info(f'Проверка авторизации пользователя: {user_id}, список: {ALLOWED_USERS}')
-    return user_id in ALLOWED_USERS
+    authorized = user_id in ALLOWED_USERS
+    logger.debug(f'Проверка авторизации пользователя {user_id}: {authorized}',
+                 extra={'event': 'auth_check', 'user': user_id})
+    return authorized
 
 # Define a few command handlers. These usually take the two arguments update and
 # context.
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.effective_user
-    logger.info(f"Пользователь {user.id} вызвал /start")
+    logger.info(f"Пользователь {user.id} вызвал /start", extra={'event': 'start', 'user': user.id})
     if not is_user_authorized(user.id):
-        logger.warning(f"Доступ запрещен для пользователя {user.id}")
+        logger.warning(f"Доступ запрещен для пользователя {user.id}", extra={'event': 'auth_denied', 'user': user.id})
         await update.message.reply_html(
             f"❌ Доступ запрещен! Ваш ID: {user.id}\n"
             f"Обратитесь к администратору для получения доступа."
         )
         return
-    # Сохраняем пользователя как активного
-    active_users[user.id] = {'query': update.message}
-    await update.message.reply_html(
+    message = await update.message.reply_html(
         rf"Hi {user.mention_html()}!",
-        reply_markup=InlineKeyboardMarkup(button_PC_control_data),
+        reply_markup=PC_control_markup,
     )
+    # Сохраняем пользователя как активного: статус будет приходить в это сообщение
+    sessions.set(user.id, message.chat_id, message.message_id)
+    render_cache.forget(user.id)
     logger.info(f"Пользователь {user.id} добавлен в активные")
 
-async def listen_time_forever(context):
-    global PC_status, last_packet_time
-    loop = asyncio.get_running_loop()
+async def listen_time_forever(context, queue: asyncio.Queue):
+    timing = bot_metrics.histogram('task_seconds', {'task': 'heartbeat'})
     while True:
-        # run_udp_port_listener_time блокирующая, поэтому в executor
-        data, _ = await loop.run_in_executor(
-            None, run_udp_port_listener_time, PORT, ETHERNET
-        )
+        # Пакеты уже разобраны слушателем, здесь только обновляем статус
+        heartbeat, addr = await queue.get()
+        started = time.perf_counter()
         try:
-            data_dict = json.loads(data.decode('utf-8'))
-            formatted_uptime = data_dict.get('formatted_uptime', 'N/A')
+            handle_heartbeat(heartbeat, addr)
         except Exception as e:
-            logger.error(f"Ошибка при обработке данных UDP: {e}")
-            data_dict = {}
-            formatted_uptime = 'N/A'
-        last_packet_time = time.time()
-        if PC_status != '🚀 Включен':
-            PC_status = '🚀 Включен'
-            logger.info(f"ПК включился. Статус обновлен: {PC_status}")
-            # ПК включился — уведомить всех активных пользователей
-            for user_id, msg_ctx in active_users.items():
-                try:
-                    await msg_ctx['query'].edit_message_text(
-                        text=f"status: {PC_status}\nвремя работы: {formatted_uptime}",
-                        reply_markup=InlineKeyboardMarkup(button_PC_control_data),
-                    )
-                    logger.info(f"Пользователь {user_id} уведомлен о включении ПК")
-                except Exception as e:
-                    logger.error(f"Ошибка при уведомлении пользователя {user_id}: {e}")
+            # Один испорченный пакет не должен останавливать прием heartbeat'ов
+            logger.error(f"Ошибка обработки heartbeat'а от {addr}: {e}", exc_info=True,
+                         extra={'event': 'bad_heartbeat'})
+        timing.observe(time.perf_counter() - started)
+
+def handle_heartbeat(heartbeat, addr):
+    sender_mac = heartbeat.mac
+    if sender_mac is not None and not isinstance(sender_mac, str):
+        logger.error(f"Некорректный sender_mac от {addr}: {sender_mac!r}", extra={'event': 'bad_heartbeat'})
+        return
+    try:
+        if sender_mac:
+            record = fleet.get_or_create(sender_mac)
+            if record is None:
+                logger.warning(f"Heartbeat ПК {sender_mac} от {addr} отброшен: ПК нет в PC_MAC_ADDRESSES "
+                               f"или реестр заполнен (MAX_PCS)", extra={'event': 'unknown_sender'})
+                return
         else:
-            # ПК уже включён — просто обновить время
-            for user_id, msg_ctx in active_users.items():
-                try:
-                    await msg_ctx['query'].edit_message_text(
-                        text=f"status: {PC_status}\nвремя работы: {formatted_uptime}",
-                        reply_markup=InlineKeyboardMarkup(button_PC_control_data),
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при обновлении времени для пользователя {user_id}: {e}")
-
-async def pc_status_timeout_checker(context, timeout=10):
-    global PC_status, last_packet_time
-    while True:
-        await asyncio.sleep(2)
-        if PC_status == '🚀 Включен' and (time.time() - last_packet_time > timeout):
-            PC_status = '⚫️ Выключен'
-            logger.info(f"ПК выключен по таймауту. Статус обновлен: {PC_status}")
-            for user_id, msg_ctx in active_users.items():
-                try:
-                    await msg_ctx['query'].message.reply_html(
-                        text=f"status: {PC_status}",
-                        reply_markup=InlineKeyboardMarkup(button_PC_control_data),
-                    )
-                    logger.info(f"Пользователь {user_id} уведомлен о выключении ПК")
-                except Exception as e:
-                    logger.error(f"Ошибка при уведомлении пользователя {user_id} о выключении: {e}")
+            # Старый агент не сообщает MAC своего ПК: узнаем ПК по адресу
+            # отправителя, а первый пакет относим к PC_MAC_ADDRESS
+            record = fleet.lookup_addr(addr[0])
+            if record is None and pc_mac_address:
+                record = fleet.get_or_create(pc_mac_address)
+    except ValueError as e:
+        logger.error(f"Некорректный sender_mac от {addr}: {e}", extra={'event': 'bad_heartbeat'})
+        return
+    if record is None:
+        logger.warning(f"Пакет старого агента от неизвестного адреса {addr}, а PC_MAC_ADDRESS не задан",
+                       extra={'event': 'unknown_sender'})
+        return
+
+    if heartbeat.kind != KIND_HEARTBEAT:
+        bot_metrics.inc('power_notices', {'mac': record.mac})
+        # Агент сообщил о выключении или сне - не ждем таймаута
+        if heartbeat.kind == KIND_SHUTDOWN:
+            changed = fleet.mark_offline(record.mac, STATUS_OFF)
+        elif heartbeat.kind == KIND_SLEEP:
+            changed = fleet.mark_offline(record.mac, STATUS_SLEEP)
+        else:
+            return
+        # Уведомление приходит в нескольких копиях, реагируем на первую
+        if changed is not None:
+            offline_deadlines.cancel(record.mac)
+            liveness.reset(record.mac)
+            notify_pc_offline(record, 'по уведомлению агента')
+        return
+
+    bot_metrics.inc('heartbeats', {'mac': record.mac})
+    now = offline_deadlines.time()
+    uptime = int(time.time() - heartbeat.boot_time) if heartbeat.boot_time else None
+    came_online = fleet.heartbeat(record, addr[0], uptime, now)
+    pc_history.record(record.mac, STATUS_ON, heartbeat.boot_time)
+    wake_tracker.on_heartbeat(record.mac, now)
+    # Переносим дедлайн выключения ПК: O(log n) на heartbeat. Таймаут
+    # подстраивается под разброс интервалов heartbeat'ов этого ПК
+    offline_deadlines.schedule(record.mac, liveness.heartbeat(record.mac, now))
+    status_view.update(record)
+    text = status_view.text()
+    if came_online:
+        logger.info(f"ПК {record.mac} включился. Статус обновлен: {record.status}",
+                    extra={'event': 'pc_online', 'mac': record.mac})
+        priority = PRIORITY_TRANSITION
+    else:
+        # ПК уже включён — просто обновить время
+        priority = PRIORITY_REFRESH
+    # Рассылка идет параллельно; ожидающее обновление чата заменяется новым.
+    # Если видимый текст не изменился, запрос вообще не отправляется
+    submitted = 0
+    for user_id, session in sessions.items():
+        if not render_cache.update(user_id, text, PC_control_markup):
+            continue
+        notifier.submit(
+            user_id,
+            lambda user_id=user_id, session=session: edit_status_message(user_id, session, text),
+            priority,
+        )
+        submitted += 1
+    bot_metrics.inc('status_edits', {'mac': record.mac}, submitted)
+    bot_metrics.inc('status_edits_skipped', {'mac': record.mac}, len(sessions) - submitted)
+
+def is_chat_gone(error: Exception) -> bool:
+    """Проверяет, сообщил ли Telegram, что чата или сообщения больше нет."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(text in error.message.lower() for text in GONE_ERRORS)
+
+def evict_session(user_id: int, error: Exception):
+    sessions.remove(user_id)
+    render_cache.forget(user_id)
+    logger.info(f"Сессия пользователя {user_id} удалена: {error}", extra={'event': 'session_evicted', 'user': user_id})
+
+async def edit_status_message(user_id: int, session, text: str):
+    try:
+        await telegram_bot.edit_message_text(
+            text,
+            chat_id=session.chat_id,
+            message_id=session.message_id,
+            reply_markup=PC_control_markup,
+        )
+    except Exception as e:
+        if is_chat_gone(e):
+            evict_session(user_id, e)
+            return
+        if isinstance(e, BadRequest) and 'not modified' in e.message.lower():
+            # В сообщении уже этот текст
+            return
+        # Сообщение не обновилось - следующая правка должна уйти в любом случае
+        render_cache.forget(user_id)
+        raise
+
+async def send_status_message(user_id: int, chat_id: int, text: str):
+    # Новое сообщение со статусом становится тем, которое правится дальше
+    try:
+        message = await telegram_bot.send_message(
+            chat_id,
+            text,
+            parse_mode=ParseMode.HTML,
+            reply_markup=PC_control_markup,
+        )
+    except Exception as e:
+        if is_chat_gone(e):
+            evict_session(user_id, e)
+            return
+        raise
+    sessions.set(user_id, message.chat_id, message.message_id)
+    render_cache.update(user_id, text, PC_control_markup)
+
+async def report_wake(user_id: int, chat_id: int, mac: str):
+    # Ждем первого heartbeat'а после WOL и сообщаем, за сколько ПК включился
+    latency = await wake_tracker.wait_until_up(mac, WAKE_TIMEOUT)
+    if latency is None:
+        text = f"⚠️ ПК {mac} не ответил за {WAKE_TIMEOUT:.0f} с"
+        logger.warning(f"ПК {mac} не включился за {WAKE_TIMEOUT:.0f} с",
+                       extra={'event': 'wake_timeout', 'user': user_id, 'mac': mac})
+    else:
+        text = f"🚀 ПК {mac} включился за {latency:.0f} с"
+        stats = wake_tracker.histograms[mac].summary()
+        logger.info(f"ПК {mac} включился за {latency:.1f} с (p50 {stats['p50']:.0f} с, p90 {stats['p90']:.0f} с)",
+                    extra={'event': 'wake', 'user': user_id, 'mac': mac, 'latency': round(latency, 3)})
+    notifier.submit(
+        user_id,
+        lambda: telegram_bot.send_message(chat_id, text),
+        PRIORITY_TRANSITION,
+        kind=f'wake:{mac}',
+    )
+
+def notify_pc_offline(record, reason: str):
+    logger.info(f"ПК {record.mac} выключен {reason}. Статус обновлен: {record.status}",
+                extra={'event': 'pc_offline', 'mac': record.mac})
+    pc_history.record(record.mac, record.status)
+    status_view.update(record)
+    text = status_view.text()
+    for user_id, session in sessions.items():
+        notifier.submit(
+            user_id,
+            lambda user_id=user_id, session=session: send_status_message(user_id, session.chat_id, text),
+            PRIORITY_TRANSITION,
+            kind='reply',
+        )
+
+def on_pc_timeout(mac: str):
+    # Вызывается планировщиком ровно в момент истечения дедлайна ПК
+    # Последний heartbeat не забываем: если ПК просто стал слать их реже,
+    # интервал до следующего попадет в распределение
+    record = fleet.mark_offline(mac)
+    if record is not None:
+        notify_pc_offline(record, 'по таймауту')
+
+async def send_pc_command(mac: str, command: str):
+    # Время отправки пакета отдельно от ответа Telegram
+    started = time.perf_counter()
+    await wol_sender.send_async(mac, command, broadcast_ip)
+    bot_metrics.histogram('pc_command_seconds', {'command': command}).observe(time.perf_counter() - started)
+
+async def deliver_pc_command(user_id: int, chat_id: int, mac: str, command: str):
+    # Повторяем команду, пока агент не подтвердит ее; пользователь узнает только о неудаче
+    delivery = await wol_sender.send_acked(mac, command, broadcast_ip, COMMAND_ACK_TIMEOUT)
+    bot_metrics.inc('command_retries', {'command': command}, delivery.retries)
+    if delivery.acked:
+        bot_metrics.histogram('command_delivery_seconds', {'command': command}).observe(delivery.latency)
+        logger.info(f"ПК {mac} подтвердил команду {command} за {delivery.latency * 1000:.0f} мс, "
+                    f"повторов: {delivery.retries}",
+                    extra={'event': 'command_acked', 'user': user_id, 'mac': mac,
+                           'latency': round(delivery.latency, 4)})
+        return
+    bot_metrics.inc('commands_unacked', {'command': command})
+    logger.warning(f"ПК {mac} не подтвердил команду {command} за {COMMAND_ACK_TIMEOUT:g} с, "
+                   f"повторов: {delivery.retries}",
+                   extra={'event': 'command_unacked', 'user': user_id, 'mac': mac})
+    notifier.submit(
+        user_id,
+        lambda: telegram_bot.send_message(chat_id, f"⚠️ ПК {mac} не подтвердил команду за {COMMAND_ACK_TIMEOUT:g} с"),
+        PRIORITY_TRANSITION,
+        kind=f'ack:{mac}',
+    )
+
+async def dispatch_power_command(user_id: int, chat_id: int, mac: str, command: str):
+    if COMMAND_ACK:
+        # Первый пакет уходит, как только обработчик отдаст управление; повторы - в фоне
+        start_background(deliver_pc_command(user_id, chat_id, mac, command))
+    else:
+        await send_pc_command(mac, command)
 
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     user = query.from_user
     user_id = user.id
-    logger.info(f"Пользователь {user_id} нажал кнопку: {query.data}")
-    # Сохраняем пользователя как активного
-    active_users[user_id] = {'query': query}
-    if query.data == "turn_on":
-        send_wol(pc_mac_address, broadcast_ip)
-        logger.info(f"Отправлен WOL для ПК {pc_mac_address}")
+    logger.info(f"Пользователь {user_id} нажал кнопку: {query.data}", extra={'event': 'button', 'user': user_id})
+    if not is_user_authorized(user_id):
+        logger.warning(f"Доступ запрещен для пользователя {user_id}", extra={'event': 'auth_denied', 'user': user_id})
+        await query.answer("❌ Доступ запрещен")
+        return
+    # Сохраняем пользователя как активного; сообщение могло стать недоступным
+    chat_id = query.message.chat_id if query.message is not None else user_id
+    if query.message is not None:
+        sessions.set(user_id, chat_id, query.message.message_id)
+    render_cache.forget(user_id)
+    # callback_data может указывать конкретный ПК: "turn_on:<MAC>". Команды
+    # уходят только известным ПК: из реестра или PC_MAC_ADDRESSES
+    action, _, target_mac = query.data.partition(':')
+    target_mac = target_mac or pc_mac_address
+    record = fleet.get(target_mac) if target_mac else None
+    if record is None:
+        logger.warning(f"Команда {action} для неизвестного ПК {target_mac!r} отклонена",
+                       extra={'event': 'unknown_target', 'user': user_id})
+        await query.answer("Неизвестный ПК")
+        return
+    target_mac = record.mac
+    if action == "turn_on":
+        # Засекаем время до отправки, чтобы не пропустить быстрый heartbeat
+        if record.status != STATUS_ON:
+            wake_tracker.arm(record.mac)
+        await send_pc_command(target_mac, COMMAND_WOL)
+        logger.info(f"Отправлен WOL для ПК {target_mac}", extra={'event': 'wol', 'user': user_id, 'mac': target_mac})
         await query.answer()
-    elif query.data == "turn_off":
+        if record.status != STATUS_ON:
+            start_background(report_wake(user_id, chat_id, record.mac))
+    elif action == "turn_off":
+        # Сначала команда ПК, потом ответ Telegram: ответ не задерживает пакет
+        await dispatch_power_command(user_id, chat_id, target_mac, COMMAND_OFF)
+        logger.info(f"Отправлен сигнал выключения для ПК {target_mac}",
+                    extra={'event': 'power_off', 'user': user_id, 'mac': target_mac})
         await query.answer()
-        send_off(pc_mac_address, broadcast_ip)
-        logger.info(f"Отправлен сигнал выключения для ПК {pc_mac_address}")
-    elif query.data == "sleep":
+    elif action == "sleep":
+        await dispatch_power_command(user_id, chat_id, target_mac, COMMAND_SLEEP)
+        logger.info(f"Отправлен сигнал сна для ПК {target_mac}",
+                    extra={'event': 'sleep', 'user': user_id, 'mac': target_mac})
         await query.answer()
-        send_sleep(pc_mac_address, broadcast_ip)
-        logger.info(f"Отправлен сигнал сна для ПК {pc_mac_address}")
     # Не обновляем статус вручную — это делает слушатель
 
+def format_timing(histogram, unit: float = 1000.0) -> str:
+    summary = histogram.summary()
+    if not summary['count']:
+        return 'нет данных'
+    return (f"n={summary['count']} p50={summary['p50'] * unit:.1f} "
+            f"p99={summary['p99'] * unit:.1f} max={summary['max'] * unit:.1f} мс")
+
+# Сколько ПК с наибольшими значениями показывать в /stats для метрик по ПК
+STATS_TOP = 3
+
+def stats_label(name: str, labels: dict) -> str:
+    return f"{name}[{','.join(map(str, labels.values()))}]" if labels else name
+
+def group_by_mac(series) -> dict:
+    """Группирует ряды метрик по меткам без mac: {(имя, метки): [(mac, значение)]}"""
+    groups = {}
+    for name, labels, value in series:
+        rest = tuple((key, label) for key, label in labels.items() if key != 'mac')
+        groups.setdefault((name, rest), []).append((labels.get('mac'), value))
+    return groups
+
+def render_stats_text() -> str:
+    """
+    Собирает текст для /stats из метрик бота. Метрики по ПК сводятся в
+    итог и STATS_TOP худших ПК, подробности по каждому ПК - на эндпоинте метрик
+    """
+    lines = [f"Задержка цикла: {format_timing(loop_lag)}"]
+    histograms = [item for item in bot_metrics.histograms() if item[0] != 'loop_lag_seconds']
+    for (name, labels), items in group_by_mac(histograms).items():
+        label = stats_label(name, dict(labels))
+        if items[0][0] is None:
+            lines.append(f"{label}: {format_timing(items[0][1])}")
+            continue
+        worst = sorted(items, key=lambda item: item[1].summary()['p99'] or 0, reverse=True)[:STATS_TOP]
+        lines.append(f"{label}: {len(items)} ПК, худшие по p99:")
+        lines += [f"  {mac}: {format_timing(histogram)}" for mac, histogram in worst]
+    if notifier is not None:
+        lines.append(f"Ответ Telegram: {format_timing(notifier.send_time)}")
+    lines.append('')
+    for (name, labels), items in group_by_mac(bot_metrics.counters()).items():
+        label = stats_label(name, dict(labels))
+        if items[0][0] is None:
+            lines.append(f"{label}: {items[0][1]}")
+            continue
+        top = sorted(items, key=lambda item: item[1], reverse=True)[:STATS_TOP]
+        lines.append(f"{label}: {sum(value for _, value in items)} ({len(items)} ПК; больше всего: "
+                     f"{', '.join(f'{mac} {value}' for mac, value in top)})")
+    for (name, labels), items in group_by_mac(bot_metrics.gauges()).items():
+        label = stats_label(name, dict(labels))
+        if items[0][0] is None:
+            lines.append(f"{label}: {items[0][1]}")
+            continue
+        values = [value for _, value in items]
+        top = sorted(items, key=lambda item: item[1], reverse=True)[:STATS_TOP]
+        lines.append(f"{label}: мин {min(values)}, макс {max(values)} ({len(items)} ПК; наибольшие: "
+                     f"{', '.join(f'{mac} {value}' for mac, value in top)})")
+    text = '\n'.join(lines)
+    if len(text) > MESSAGE_LIMIT:
+        # Метрик без mac тоже может стать много: обрезаем по строкам
+        tail = '\n... полный список - на эндпоинте метрик'
+        text = text[:text.rindex('\n', 0, MESSAGE_LIMIT - len(tail))] + tail
+    return text
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает метрики бота администратору."""
+    user = update.effective_user
+    if user.id not in ADMIN_USERS:
+        logger.warning(f"Команда /stats недоступна пользователю {user.id}",
+                       extra={'event': 'auth_denied', 'user': user.id})
+        return
+    await update.message.reply_text(render_stats_text())
+
+def render_history_text(rollups: dict, days: int) -> str:
+    """Собирает текст для /history из суточных сводок."""
+    macs = [record.mac for record in fleet]
+    macs += sorted(mac for mac in rollups if mac not in macs)
+    blocks = []
+    for mac in macs:
+        per_day = rollups.get(mac, {})
+        on_seconds = sum(rollup.on_seconds for rollup in per_day.values())
+        boots = sum(rollup.boots for rollup in per_day.values())
+        lines = [mac, f"включен за {days} дн.: {format_uptime(on_seconds, 60)}, загрузок: {boots}"]
+        if days <= 14:
+            for day, rollup in per_day.items():
+                if rollup.on_seconds:
+                    lines.append(f"  {time.strftime('%d.%m', time.localtime(day))}: "
+                                 f"{format_uptime(rollup.on_seconds, 60)}")
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks) or 'История пока пуста'
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает, сколько ПК были включены за последние дни: /history [дней]."""
+    user = update.effective_user
+    if not is_user_authorized(user.id):
+        logger.warning(f"Команда /history недоступна пользователю {user.id}",
+                       extra={'event': 'auth_denied', 'user': user.id})
+        return
+    try:
+        days = int(context.args[0]) if context.args else 7
+    except ValueError:
+        await update.message.reply_text("Использование: /history [число дней]")
+        return
+    days = min(max(days, 1), 366)
+    # Период - целые местные сутки, включая сегодняшние
+    rollups = await pc_history.rollup(day_start(time.time() - (days - 1) * DAY))
+    await update.message.reply_text(render_history_text(rollups, days))
+
+def collect_runtime_stats():
+    # Счетчики, которые ведут сами объекты бота
+    if notifier is not None:
+        yield 'notify_sent', {}, notifier.sent
+        yield 'notify_collapsed', {}, notifier.collapsed
+        yield 'notify_failed', {}, notifier.failed
+        yield 'notify_pending', {}, len(notifier)
+    yield 'render_skipped', {}, render_cache.skipped
+    yield 'fleet_size', {}, len(fleet)
+    yield 'fleet_rejected', {}, fleet.rejected
+    yield 'active_users', {}, len(sessions)
+    yield 'session_writes', {}, sessions.writes
+    yield 'history_writes', {}, pc_history.writes
+    yield 'history_dropped', {}, pc_history.dropped
+    for mac, detector in liveness.detectors.items():
+        yield 'liveness_timeout_seconds', {'mac': mac}, round(detector.timeout(), 3)
+    if heartbeat_listener is not None:
+        for key, value in heartbeat_listener.receiver.stats().items():
+            yield f'heartbeat_packets_{key}', {}, value
+
+bot_metrics.add_collector(collect_runtime_stats)
+
 async def post_init(app):
-    app.create_task(listen_time_forever(app))
-    app.create_task(pc_status_timeout_checker(app))
+    global heartbeat_listener, offline_deadlines, notifier, wol_sender, metrics_server, telegram_bot
+    telegram_bot = app.bot
+    # Сессии с прошлого запуска: статус снова приходит без повторного /start
+    await sessions.load()
+    app.create_task(sessions.run())
+    app.create_task(pc_history.run())
+    # Сокет создается и привязывается один раз на все время работы бота
+    heartbeat_queue = asyncio.Queue(maxsize=1024)
+    heartbeat_listener = await start_time_listener(PORT, heartbeat_queue)
+    # Выключение ПК фиксируется ровно по дедлайну, без опроса
+    offline_deadlines = DeadlineScheduler(on_pc_timeout)
+    notifier = EditDispatcher()
+    wol_sender = WolSender()
+    app.create_task(notifier.run())
+    app.create_task(listen_time_forever(app, heartbeat_queue))
+    app.create_task(monitor_loop_lag(loop_lag))
+    if METRICS_PORT:
+        metrics_server = await start_metrics_server(bot_metrics, METRICS_HOST, METRICS_PORT, prefix='pcbot_')
+        logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def post_stop(app):
+    # Не ждем включения ПК и подтверждений команд при остановке бота
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+async def post_shutdown(app):
+    if offline_deadlines is not None:
+        offline_deadlines.close()
+    if heartbeat_listener is not None:
+        heartbeat_listener.close()
+    if wol_sender is not None:
+        wol_sender.close()
+    if metrics_server is not None:
+        metrics_server.close()
+    await sessions.close()
+    await pc_history.close()
+
+# Какой тип обновлений нужен каждому виду обработчика
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: Update.MESSAGE,
+    CallbackQueryHandler: Update.CALLBACK_QUERY,
+}
+
+def allowed_updates(application) -> list:
+    """Типы обновлений, для которых зарегистрированы обработчики"""
+    return sorted({
+        HANDLER_UPDATE_TYPES[type(handler)]
+        for handlers in application.handlers.values()
+        for handler in handlers
+    })
+
+async def run_webhook(application):
+    """
+    Работа через webhook: Telegram сам присылает обновления на локальный
+    сервер, поэтому нажатие кнопки доходит без задержки long polling'а
+    и без постоянных запросов getUpdates
+    """
+    from webhook import WebhookServer
+
+    ssl_context = None
+    if WEBHOOK_CERT:
+        import ssl
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+
+    server = WebhookServer(application, WEBHOOK_PATH, WEBHOOK_SECRET)
+    await application.initialize()
+    await post_init(application)
+    try:
+        await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT, ssl_context)
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            allowed_updates=allowed_updates(application),
+            secret_token=WEBHOOK_SECRET,
+        )
+        await application.start()
+        logger.info("Бот Telegram запущен (webhook)")
+        # Работаем до Ctrl-C: asyncio.run отменит эту задачу
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        if application.running:
+            await application.stop()
+        await post_stop(application)
+        await post_shutdown(application)
+        await application.shutdown()
+
+def build_application(token: str = None, base_url: str = None, with_updater: bool = True):
+    """
+    Создает приложение бота и регистрирует обработчики
+
+    Args:
+        token (str): Токен бота (по умолчанию TELEGRAM_BOT_TOKEN)
+        base_url (str): Адрес Bot API (например, локальная заглушка для нагрузочных тестов)
+        with_updater (bool): Нужен ли getUpdates (в режиме webhook не нужен)
+
+    Returns:
+        Application: Приложение без запущенного опроса
+    """
+    builder = Application.builder().token(token or telegram_bot_token)
+    if base_url:
+        builder = builder.base_url(base_url)
+    if not with_updater:
+        # Обновления приходят на наш сервер, getUpdates не нужен
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # on different commands - answer in Telegram
+    # Время каждого обработчика пишется в гистограмму handler_seconds
+    application.add_handler(CommandHandler(
+        "start", timed(bot_metrics.histogram('handler_seconds', {'handler': 'start'}))(start)))
+    application.add_handler(CommandHandler(
+        "stats", timed(bot_metrics.histogram('handler_seconds', {'handler': 'stats'}))(stats)))
+    application.add_handler(CommandHandler(
+        "history", timed(bot_metrics.histogram('handler_seconds', {'handler': 'history'}))(history)))
+    application.add_handler(CallbackQueryHandler(
+        timed(bot_metrics.histogram('handler_seconds', {'handler': 'button'}))(button)))
+    return application
 
 def main() -> None:
     """Start the bot."""
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(telegram_bot_token).build()
+    application = build_application(with_updater=BOT_MODE != 'webhook')
     logger.info("Бот Telegram инициализирован")
     print(str(application)[:-10])
+    use_selector_event_loop()
 
-    
-    # on different commands - answer in Telegram
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button))
+    if BOT_MODE == 'webhook':
+        try:
+            asyncio.run(run_webhook(application))
+        except KeyboardInterrupt:
+            pass
+        return
 
     # Запускаем фоновый слушатель и таймаут-детектор
     application.post_init = post_init
+    application.post_stop = post_stop
+    application.post_shutdown = post_shutdown
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
     logger.info("Бот Telegram запущен (polling)")
+    application.run_polling(allowed_updates=allowed_updates(application))
 
 
 if __name__ == "__main__":
@@ -28,7 +28,7 @@ for noisy_logger in [
 from wol import send_wol, send_off, send_sleep
 from telegram import InlineKeyboardButton, Update, InlineKeyboardMarkup
 from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes
-from listen_time import run_udp_port_listener_time
+from listen_time import start_time_listener
 
 
 load_dotenv()
@@ -101,11 +101,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # Исправленный вариант:
 async def listen_time_forever2(context=None, timeout=1):
     global PC_status, last_packet_time
-    port = PORT
-    interface = INTERFACE
-    while True:
-        try:
-            data, _ = await run_udp_port_listener_time(port, interface)
+    queue = asyncio.Queue()
+    listener = await start_time_listener(PORT, queue)
+    try:
+        while True:
+            data, _ = await queue.get()
             print(data)
             logger.info(f'Получен пакет {data}')
             last_packet_time = time.time()
@@ -113,9 +113,8 @@ async def listen_time_forever2(context=None, timeout=1):
                 PC_status = '🚀 Включен'
                 logger.info(f"ПК включился. Статус обновлен: {PC_status}")
                 # Здесь можно уведомить пользователей, если нужно
-        except Exception as e:
-            logger.error(f"Ошибка в listen_time_forever: {e}")
-            await asyncio.sleep(1)
+    finally:
+        listener.close()
 
 
 
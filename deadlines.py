@@ -0,0 +1,116 @@
+# Планировщик дедлайнов: срабатывает ровно в момент истечения срока,
+# без периодического опроса
+
+import asyncio
+import heapq
+
+
+class DeadlineScheduler:
+    """
+    Min-heap дедлайнов по ключам с одним таймером loop.call_at.
+
+    Повторный schedule() для ключа просто кладет новую запись в кучу
+    (O(log n)), старая запись становится устаревшей и выбрасывается,
+    когда оказывается на вершине. Таймер всегда взведен на ближайший
+    актуальный дедлайн, поэтому event loop не просыпается впустую.
+    Время - монотонные часы event loop (loop.time()).
+    """
+
+    def __init__(self, callback, loop: asyncio.AbstractEventLoop = None):
+        """
+        Args:
+            callback: Функция callback(key), вызываемая при истечении дедлайна
+            loop: Event loop (по умолчанию - текущий запущенный)
+        """
+        self._callback = callback
+        self._loop = loop or asyncio.get_running_loop()
+        self._heap = []
+        self._deadlines = {}
+        self._timer = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def time(self) -> float:
+        """Текущее время по часам планировщика"""
+        return self._loop.time()
+
+    def schedule(self, key, deadline: float):
+        """
+        Назначает (или переназначает) дедлайн для ключа
+
+        Args:
+            key: Ключ (например, MAC-адрес ПК)
+            deadline (float): Момент срабатывания по часам loop.time()
+        """
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        # Не даем куче разрастись из-за устаревших записей
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, k) for k, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        self._arm()
+
+    def schedule_in(self, key, delay: float):
+        """Назначает дедлайн через delay секунд от текущего момента"""
+        self.schedule(key, self._loop.time() + delay)
+
+    def cancel(self, key) -> bool:
+        """
+        Снимает дедлайн ключа
+
+        Returns:
+            bool: True, если дедлайн был назначен
+        """
+        if self._deadlines.pop(key, None) is None:
+            return False
+        self._arm()
+        return True
+
+    def close(self):
+        """Снимает все дедлайны и таймер"""
+        self._heap.clear()
+        self._deadlines.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _is_stale(self, entry) -> bool:
+        deadline, key = entry
+        return self._deadlines.get(key) != deadline
+
+    def _arm(self):
+        heap = self._heap
+        while heap and self._is_stale(heap[0]):
+            heapq.heappop(heap)
+
+        if not heap:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return
+
+        when = heap[0][0]
+        if self._timer is not None:
+            if self._timer.when() == when:
+                return
+            self._timer.cancel()
+        self._timer = self._loop.call_at(when, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        now = self._loop.time()
+        heap = self._heap
+        try:
+            while heap and heap[0][0] <= now:
+                entry = heapq.heappop(heap)
+                if self._is_stale(entry):
+                    continue
+                deadline, key = entry
+                del self._deadlines[key]
+                self._callback(key)
+        finally:
+            self._arm()
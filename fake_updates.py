@@ -0,0 +1,110 @@
+# Заглушка Telegram для проверки webhook'а: шлет боту поддельные обновления
+#
+# python fake_updates.py --url http://127.0.0.1:8443/telegram --secret <WEBHOOK_SECRET> \
+#     --user 123456789 --data turn_on --count 20
+
+import argparse
+import http.client
+import itertools
+import json
+import statistics
+import time
+import urllib.parse
+
+update_ids = itertools.count(1)
+
+
+def user_dict(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+
+
+def command_update(user_id: int, text: str = '/start') -> dict:
+    """Обновление с сообщением-командой, как его присылает Telegram"""
+    update_id = next(update_ids)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user_dict(user_id),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+        },
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    """Обновление с нажатием inline-кнопки"""
+    update_id = next(update_ids)
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user_dict(user_id),
+            'chat_instance': '1',
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'status',
+            },
+        },
+    }
+
+
+def post_updates(url: str, updates, secret: str = None) -> list:
+    """
+    Отправляет обновления по одному соединению (как Telegram, keep-alive)
+
+    Returns:
+        list: (HTTP-статус, время ответа в секундах) для каждого обновления
+    """
+    parsed = urllib.parse.urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parsed.hostname, parsed.port, timeout=10)
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+    results = []
+    try:
+        for update in updates:
+            body = json.dumps(update).encode()
+            started = time.perf_counter()
+            connection.request('POST', parsed.path or '/', body, headers)
+            response = connection.getresponse()
+            response.read()
+            results.append((response.status, time.perf_counter() - started))
+            if response.will_close:
+                connection.close()
+    finally:
+        connection.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Поддельные обновления Telegram для webhook бота')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', help='WEBHOOK_SECRET бота')
+    parser.add_argument('--user', type=int, default=123456789, help='ID пользователя Telegram')
+    parser.add_argument('--data', default='turn_on', help='callback_data кнопки')
+    parser.add_argument('--count', type=int, default=10, help='Сколько нажатий отправить')
+    parser.add_argument('--start', action='store_true', help='Сначала отправить /start')
+    args = parser.parse_args(argv)
+
+    updates = [callback_update(args.user, args.data) for _ in range(args.count)]
+    if args.start:
+        updates.insert(0, command_update(args.user))
+
+    results = post_updates(args.url, updates, args.secret)
+    statuses = [status for status, _ in results]
+    latencies = [latency * 1000 for _, latency in results]
+    print(f'Отправлено {len(results)}, ответы: {dict((s, statuses.count(s)) for s in set(statuses))}')
+    print(f'Время ответа webhook\'а: медиана {statistics.median(latencies):.2f} мс, '
+          f'макс {max(latencies):.2f} мс')
+
+
+if __name__ == '__main__':
+    main()
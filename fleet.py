@@ -0,0 +1,283 @@
+# Реестр компьютеров: состояние каждого ПК хранится по его MAC-адресу
+
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+STATUS_ON = '🚀 Включен'
+STATUS_OFF = '⚫️ Выключен'
+STATUS_SLEEP = '🛏️ Спит'
+
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+
+@lru_cache(maxsize=4096)
+def normalize_mac(mac_address: str) -> str:
+    """
+    Приводит MAC-адрес к единому формату XX-XX-XX-XX-XX-XX
+
+    Args:
+        mac_address (str): MAC-адрес с разделителями ':' или '-'
+
+    Returns:
+        str: MAC-адрес в верхнем регистре через тире
+
+    Raises:
+        ValueError: Если MAC-адрес не состоит из 6 байт
+    """
+    digits = mac_address.replace(':', '').replace('-', '').upper()
+    if len(digits) != 12:
+        raise ValueError(f'Неверный MAC-адрес: {mac_address!r}')
+    return '-'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def format_uptime(uptime_seconds, resolution: int = 1) -> str:
+    """
+    Форматирует время работы так же, как агент на ПК
+
+    Args:
+        uptime_seconds (int | None): Время работы в секундах
+        resolution (int): Шаг отображения в секундах; при шаге от минуты
+            секунды не показываются, и текст меняется реже
+
+    Returns:
+        str: Строка вида '1d 2h 3m 4s' (или '1d 2h 3m') либо 'N/A'
+    """
+    if uptime_seconds is None:
+        return 'N/A'
+    uptime_seconds = int(uptime_seconds)
+    if resolution > 1:
+        uptime_seconds -= uptime_seconds % resolution
+    days, rest = divmod(uptime_seconds, 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if resolution >= 60:
+        return f"{days}d {hours}h {minutes}m"
+    return f"{days}d {hours}h {minutes}m {seconds}s"
+
+
+class PCRecord:
+    """Состояние одного ПК"""
+
+    __slots__ = ('mac', 'status', 'last_seen', 'uptime', 'ip')
+
+    def __init__(self, mac: str):
+        self.mac = mac
+        self.status = STATUS_OFF
+        self.last_seen = 0.0
+        self.uptime = None
+        self.ip = None
+
+    def __repr__(self):
+        return f'PCRecord({self.mac}, {self.status}, ip={self.ip})'
+
+
+class FleetRegistry:
+    """
+    Реестр ПК с индексами по MAC и по адресу отправителя.
+
+    Время last_seen - монотонное (time.monotonic / loop.time()), сроки
+    таймаутов ведет DeadlineScheduler из deadlines.py.
+
+    Новые ПК появляются по heartbeat'ам от любого хоста сети, поэтому реестр
+    ограничен: если задан allowed, заводятся только ПК из этого списка,
+    иначе - не больше max_size ПК.
+    """
+
+    def __init__(self, allowed=None, max_size: int = None):
+        self.allowed = frozenset(normalize_mac(mac) for mac in allowed) if allowed else None
+        self.max_size = max_size
+        self.by_mac = {}
+        self.by_addr = {}
+        self.rejected = 0
+        for mac in self.allowed or ():
+            self.by_mac[mac] = PCRecord(mac)
+
+    def __len__(self):
+        return len(self.by_mac)
+
+    def __iter__(self):
+        return iter(self.by_mac.values())
+
+    def get(self, mac_address: str):
+        """Возвращает запись уже известного ПК или None (в том числе для неверного MAC)"""
+        try:
+            return self.by_mac.get(normalize_mac(mac_address))
+        except ValueError:
+            return None
+
+    def get_or_create(self, mac_address: str):
+        """
+        Возвращает запись ПК, создавая ее при первом обращении
+
+        Returns:
+            PCRecord | None: Запись или None, если ПК нет в allowed или реестр заполнен
+
+        Raises:
+            ValueError: Если MAC-адрес неверный
+        """
+        mac = normalize_mac(mac_address)
+        record = self.by_mac.get(mac)
+        if record is None:
+            if self.allowed is not None or (self.max_size is not None and len(self.by_mac) >= self.max_size):
+                self.rejected += 1
+                return None
+            record = self.by_mac[mac] = PCRecord(mac)
+        return record
+
+    def lookup_addr(self, ip: str):
+        """Возвращает запись ПК по IP отправителя или None"""
+        return self.by_addr.get(ip)
+
+    def heartbeat(self, record: PCRecord, ip: str, uptime=None, now: float = None) -> bool:
+        """
+        Отмечает получение heartbeat'а от ПК
+
+        Args:
+            record (PCRecord): Запись ПК
+            ip (str): IP-адрес отправителя
+            uptime (int | None): Время работы ПК в секундах
+            now (float): Время получения пакета по монотонным часам
+
+        Returns:
+            bool: True, если ПК только что перешел в статус "включен"
+        """
+        if now is None:
+            now = time.monotonic()
+        if record.ip != ip:
+            if self.by_addr.get(record.ip) is record:
+                del self.by_addr[record.ip]
+            record.ip = ip
+            self.by_addr[ip] = record
+
+        record.last_seen = now
+        record.uptime = uptime
+
+        if record.status != STATUS_ON:
+            record.status = STATUS_ON
+            return True
+        return False
+
+    def mark_offline(self, mac: str, status: str = STATUS_OFF):
+        """
+        Переводит ПК в статус "выключен" или "спит"
+
+        Args:
+            mac (str): Нормализованный MAC-адрес ПК
+            status (str): STATUS_OFF или STATUS_SLEEP
+
+        Returns:
+            PCRecord | None: Запись ПК, если статус действительно изменился
+        """
+        record = self.by_mac.get(mac)
+        if record is None or record.status == status:
+            return None
+        record.status = status
+        return record
+
+
+def render_block(record: PCRecord, resolution: int = 1) -> str:
+    """Текст статуса одного ПК (без MAC-адреса)"""
+    lines = [f"status: {record.status}"]
+    if record.status == STATUS_ON:
+        lines.append(f"время работы: {format_uptime(record.uptime, resolution)}")
+    return '\n'.join(lines)
+
+
+class StatusView:
+    """
+    Текст статуса парка для сообщения Telegram.
+
+    Текст каждого ПК кэшируется и перерисовывается только при изменении
+    его записи; общий текст собирается заново, только если какой-то блок
+    действительно изменился. Пока все ПК помещаются в limit символов,
+    показываются все. Иначе сообщение - сводка: число ПК по статусам и
+    ПК, статус которых менялся последним (до recent штук, сколько
+    поместится). Длина и счетчики ведутся по мере изменений, поэтому
+    сводка собирается без обхода всего парка.
+    """
+
+    def __init__(self, fleet: FleetRegistry, resolution: int = 1, limit: int = MESSAGE_LIMIT, recent: int = 20):
+        self.fleet = fleet
+        self.resolution = resolution
+        self.limit = limit
+        self.recent = recent
+        self._blocks = {}
+        self._statuses = {}
+        self._counts = Counter()
+        # Последние ПК со сменой статуса, новые в конце
+        self._changed = OrderedDict()
+        # Длина полного текста: MAC, блок и разделитель для каждого ПК
+        self._length = 0
+        self._text = None
+
+    def update(self, record: PCRecord, track: bool = True) -> bool:
+        """
+        Перерисовывает блок ПК после изменения его записи
+
+        Args:
+            record (PCRecord): Запись ПК
+            track (bool): Показывать ли смену статуса среди последних изменений
+
+        Returns:
+            bool: True, если текст блока изменился
+        """
+        block = render_block(record, self.resolution)
+        old = self._blocks.get(record.mac)
+        if old == block:
+            return False
+        self._blocks[record.mac] = block
+        if old is None:
+            self._length += len(record.mac) + len(block) + 3
+        else:
+            self._length += len(block) - len(old)
+
+        status = self._statuses.get(record.mac)
+        if status != record.status:
+            if status is not None:
+                self._counts[status] -= 1
+            self._counts[record.status] += 1
+            self._statuses[record.mac] = record.status
+            if track:
+                self._changed.pop(record.mac, None)
+                self._changed[record.mac] = None
+                if len(self._changed) > self.recent:
+                    self._changed.popitem(last=False)
+        self._text = None
+        return True
+
+    def _sync(self):
+        # ПК, добавленные в реестр без heartbeat'а (из .env или кнопкой)
+        if len(self._blocks) != len(self.fleet):
+            for record in self.fleet:
+                if record.mac not in self._blocks:
+                    self.update(record, track=False)
+
+    def text(self) -> str:
+        """Текст сообщения со статусом"""
+        self._sync()
+        if self._text is None:
+            self._text = self._render()
+        return self._text
+
+    def _render(self) -> str:
+        if len(self._blocks) == 1:
+            return next(iter(self._blocks.values()))
+        if self._length - 2 <= self.limit:
+            return '\n\n'.join(f'{mac}\n{block}' for mac, block in self._blocks.items())
+
+        counts = ', '.join(f'{status}: {self._counts[status]}'
+                           for status in (STATUS_ON, STATUS_OFF, STATUS_SLEEP) if self._counts[status])
+        parts = [f'ПК: {len(self._blocks)} ({counts})', 'Последние изменения:']
+        # Запас под строку с числом скрытых ПК
+        budget = self.limit - sum(len(part) + 2 for part in parts) - 40
+        for mac in reversed(self._changed):
+            part = f'{mac}\n{self._blocks[mac]}'
+            if len(part) + 2 > budget:
+                break
+            parts.append(part)
+            budget -= len(part) + 2
+        hidden = len(self._blocks) - (len(parts) - 2)
+        parts.append(f'... и еще {hidden} ПК')
+        return '\n\n'.join(parts)
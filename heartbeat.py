@@ -0,0 +1,126 @@
+# Компактный бинарный формат heartbeat'а агента (с поддержкой старого JSON)
+#
+# Формат версии 1, сетевой порядок байт, 18 байт:
+#   2 байта  magic  b'PL'
+#   1 байт   версия формата
+#   1 байт   тип сообщения (KIND_*)
+#   6 байт   MAC-адрес отправителя
+#   4 байта  время загрузки системы (unix time, секунды)
+#   4 байта  порядковый номер пакета
+
+import math
+import struct
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+MAGIC = b'PL'
+VERSION = 1
+
+KIND_HEARTBEAT = 0
+KIND_SHUTDOWN = 1  # Агент выключает ПК
+KIND_SLEEP = 2     # Агент переводит ПК в сон
+KIND_ACK = 3       # Подтверждение командного пакета; seq - id команды
+
+# Поле "event" в JSON-формате для тех же сообщений
+JSON_EVENTS = {
+    'shutdown': KIND_SHUTDOWN,
+    'sleep': KIND_SLEEP,
+}
+
+HEARTBEAT_STRUCT = struct.Struct('!2sBB6sII')
+HEARTBEAT_SIZE = HEARTBEAT_STRUCT.size
+
+# Разобранный пакет: kind, MAC (XX-XX-XX-XX-XX-XX или None), boot_time, seq
+Heartbeat = namedtuple('Heartbeat', 'kind mac boot_time seq')
+
+
+def encode_heartbeat(mac_bytes: bytes, boot_time: float, seq: int, kind: int = KIND_HEARTBEAT) -> bytes:
+    """
+    Упаковывает heartbeat в бинарный формат
+
+    Args:
+        mac_bytes (bytes): MAC-адрес отправителя (6 байт)
+        boot_time (float): Время загрузки системы (unix time)
+        seq (int): Порядковый номер пакета
+        kind (int): Тип сообщения
+
+    Returns:
+        bytes: Пакет длиной HEARTBEAT_SIZE
+    """
+    return HEARTBEAT_STRUCT.pack(MAGIC, VERSION, kind, mac_bytes, int(boot_time), seq & 0xFFFFFFFF)
+
+
+@lru_cache(maxsize=4096)
+def mac_bytes_to_str(mac_bytes: bytes) -> str:
+    """Преобразует 6 байт MAC-адреса в строку XX-XX-XX-XX-XX-XX"""
+    return mac_bytes.hex('-').upper()
+
+
+def is_binary(data) -> bool:
+    """Похож ли пакет на бинарный heartbeat (по magic)"""
+    return len(data) >= HEARTBEAT_SIZE and data[0] == MAGIC[0] and data[1] == MAGIC[1]
+
+
+def decode_binary(data):
+    """
+    Разбирает бинарный heartbeat прямо из буфера (bytes или memoryview)
+
+    Args:
+        data: Принятые байты
+
+    Returns:
+        Heartbeat | None: Разобранный пакет или None для чужого/другой версии
+    """
+    if not is_binary(data):
+        return None
+    _, version, kind, mac_bytes, boot_time, seq = HEARTBEAT_STRUCT.unpack_from(data)
+    if version != VERSION:
+        return None
+    return Heartbeat(kind, mac_bytes_to_str(mac_bytes), boot_time, seq)
+
+
+def is_legacy_json(data_dict: dict) -> bool:
+    """
+    Пакет старого агента: в нем нет ни seq, ни event, а sender_mac - это
+    MAC-адрес сервера (SERVER_MAC_ADDRESS из его .env), а не самого ПК
+    """
+    return 'seq' not in data_dict and 'event' not in data_dict
+
+
+def _number(value, kind=(int, float)):
+    # bool - подкласс int, но числом в пакете не считается
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, kind):
+        raise ValueError(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(value)
+    return value
+
+
+def from_json(data_dict: dict):
+    """
+    Приводит JSON-пакет (heartbeat или событие "event") к тому же виду, что и бинарный
+
+    Args:
+        data_dict (dict): Разобранный JSON от агента
+
+    Returns:
+        Heartbeat | None: Пакет; поля, которых нет в JSON, равны None. У пакета
+            старого агента mac равен None: ПК определяет бот (см. is_legacy_json).
+            None, если у поля неверный тип
+    """
+    try:
+        boot_time = _number(data_dict.get('boot_time'))
+        uptime = _number(data_dict.get('uptime_seconds'))
+        seq = _number(data_dict.get('seq'), int)
+    except ValueError:
+        return None
+    if boot_time is None and uptime is not None:
+        boot_time = time.time() - uptime
+    kind = JSON_EVENTS.get(data_dict.get('event'), KIND_HEARTBEAT)
+    mac = None if is_legacy_json(data_dict) else data_dict.get('sender_mac')
+    if mac is not None and not isinstance(mac, str):
+        return None
+    return Heartbeat(kind, mac, boot_time, seq)
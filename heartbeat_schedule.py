@@ -0,0 +1,92 @@
+# Расписание heartbeat'ов агента: пачка при запуске, частые пакеты после
+# загрузки или выхода из сна, редкие - в установившемся режиме
+
+import time
+
+
+class HeartbeatScheduler:
+    """
+    Расписание отправки heartbeat'ов с обнаружением выхода из сна.
+
+    Выход из сна определяется двумя способами:
+    - на Linux/macOS монотонные часы во сне стоят, а системные идут,
+      поэтому разница time.time() - time.monotonic() скачком растет;
+    - на Windows монотонные часы идут и во сне, зато ожидание
+      длится намного дольше заказанного.
+    После выхода из сна heartbeat отправляется сразу, и расписание
+    снова начинается с пачки и частых пакетов.
+    """
+
+    def __init__(self, steady_interval: float = 5.0, fast_interval: float = 1.0,
+                 fast_period: float = 60.0, burst: int = 3, burst_interval: float = 0.3,
+                 resume_threshold: float = 2.0, check_interval: float = 1.0):
+        """
+        Args:
+            steady_interval (float): Интервал в установившемся режиме, с
+            fast_interval (float): Интервал сразу после запуска или выхода из сна, с
+            fast_period (float): Сколько секунд действует частый интервал
+            burst (int): Сколько heartbeat'ов отправить пачкой при запуске
+            burst_interval (float): Интервал внутри пачки, с
+            resume_threshold (float): Скачок часов, который считается выходом из сна, с
+            check_interval (float): Как часто проверять выход из сна, с
+        """
+        self.steady_interval = steady_interval
+        self.fast_interval = fast_interval
+        self.fast_period = fast_period
+        self.burst = burst
+        self.burst_interval = burst_interval
+        self.resume_threshold = resume_threshold
+        self.check_interval = check_interval
+        self.resumes = 0
+
+        now = time.monotonic()
+        self._offset = time.time() - now
+        self._last_check = now
+        self._restart(now)
+
+    def _restart(self, now: float):
+        self._next = now
+        self._fast_until = now + self.fast_period
+        self._burst_left = self.burst
+
+    def check_resume(self) -> bool:
+        """
+        Проверяет, не было ли выхода из сна с прошлой проверки
+
+        Returns:
+            bool: True, если ПК только что проснулся (heartbeat нужен сразу)
+        """
+        now = time.monotonic()
+        offset = time.time() - now
+        clock_jump = offset - self._offset
+        overslept = now - self._last_check - self.check_interval
+        self._offset = offset
+        self._last_check = now
+        if clock_jump > self.resume_threshold or overslept > self.resume_threshold:
+            self.resumes += 1
+            self._restart(now)
+            return True
+        return False
+
+    def restart(self):
+        """Начинает расписание заново: серия и частые heartbeat'ы (например, после смены адреса)"""
+        self._restart(time.monotonic())
+
+    def due(self) -> bool:
+        """Пора ли отправлять heartbeat"""
+        return time.monotonic() >= self._next
+
+    def sent(self):
+        """Отмечает отправку heartbeat'а и назначает следующую"""
+        now = time.monotonic()
+        if self._burst_left > 1:
+            self._burst_left -= 1
+            interval = self.burst_interval
+        else:
+            self._burst_left = 0
+            interval = self.fast_interval if now < self._fast_until else self.steady_interval
+        self._next = now + interval
+
+    def sleep_time(self) -> float:
+        """Сколько спать до следующего события: heartbeat'а или проверки сна"""
+        return max(0.0, min(self._next - time.monotonic(), self.check_interval))
@@ -0,0 +1,263 @@
+# История состояний ПК: сколько каждый ПК был включен, со сводками по часам и дням в SQLite
+
+import asyncio
+import sqlite3
+import time
+from collections import deque, namedtuple
+
+from fleet import STATUS_ON
+from sqlite_store import SQLiteStore
+
+HOUR = 3600
+DAY = 86400
+
+# Время загрузки в heartbeat'ах JSON-формата считается по uptime и немного
+# плавает; новая загрузка - только если оно сдвинулось сильнее
+BOOT_TOLERANCE = 60
+
+# Замер: момент (unix time), статус из fleet, время загрузки ПК (или None)
+Sample = namedtuple('Sample', 'time status boot_time')
+
+# Сводка за период: секунд во включенном состоянии, heartbeat'ов, смен статуса, загрузок
+Rollup = namedtuple('Rollup', 'on_seconds heartbeats transitions boots')
+
+_UPSERT = (
+    'INSERT INTO {table} (mac, {key}, on_seconds, heartbeats, transitions, boots) '
+    'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(mac, {key}) DO UPDATE SET '
+    'on_seconds=on_seconds+excluded.on_seconds, heartbeats=heartbeats+excluded.heartbeats, '
+    'transitions=transitions+excluded.transitions, boots=boots+excluded.boots'
+)
+
+
+def day_start(timestamp: float) -> int:
+    """Начало местных суток, в которые попадает timestamp"""
+    t = time.localtime(timestamp)
+    return int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+
+def _add(totals: list, values):
+    for index, value in enumerate(values):
+        totals[index] += value
+
+
+class _Machine:
+    """Последние замеры одного ПК"""
+
+    __slots__ = ('recent', 'boot_time', 'last_stored')
+
+    def __init__(self, size: int):
+        self.recent = deque(maxlen=size)
+        self.boot_time = None
+        # Когда heartbeat этого ПК последний раз попал в сырые замеры
+        self.last_stored = 0.0
+
+
+class HistoryStore(SQLiteStore):
+    """
+    История ПК: последние замеры в памяти, сводки по часам и дням в SQLite (WAL).
+
+    Каждый heartbeat и смена статуса попадают в кольцевой буфер ПК
+    (ring_size последних замеров), а время работы сразу раскладывается по
+    часам: интервал между двумя heartbeat'ами засчитывается, если ПК все это
+    время был включен, то есть между ними не было записано смены статуса
+    (вызывающий код записывает каждое выключение); max_gap, если задан,
+    дополнительно ограничивает интервал. Новые замеры и приращения
+    часовых сводок записываются одной транзакцией раз в flush_interval
+    секунд в отдельном потоке.
+
+    Размер базы ограничен: сырые замеры (heartbeat'ы - не чаще раза в
+    sample_interval) хранятся raw_retention секунд, часовые сводки старше
+    hourly_retention сворачиваются в суточные, суточные старше
+    daily_retention удаляются. Запросы за период читают только сводки.
+    """
+
+    subject = 'истории ПК'
+
+    def __init__(self, path: str = 'history.db', flush_interval: float = 30.0, max_gap: float = None,
+                 ring_size: int = 256, sample_interval: float = 60.0, raw_retention: float = 2 * DAY,
+                 hourly_retention: float = 14 * DAY, daily_retention: float = 400 * DAY,
+                 max_pending: int = 100_000):
+        super().__init__(path, flush_interval)
+        self.max_gap = max_gap
+        self.ring_size = ring_size
+        self.sample_interval = sample_interval
+        self.raw_retention = raw_retention
+        self.hourly_retention = hourly_retention
+        self.daily_retention = daily_retention
+        self.max_pending = max_pending
+        self.started = time.time()
+        self._machines = {}
+        # Еще не записанные замеры и приращения часовых сводок
+        self._pending = []
+        self._hourly = {}
+        # Поток записи и запросы не работают с соединением одновременно
+        self._lock = asyncio.Lock()
+        self._last_compaction = 0.0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._machines)
+
+    def recent(self, mac: str) -> list:
+        """Последние замеры ПК из памяти, от старых к новым"""
+        machine = self._machines.get(mac)
+        return list(machine.recent) if machine is not None else []
+
+    def record(self, mac: str, status: str, boot_time: float = None, now: float = None):
+        """
+        Учитывает heartbeat (status == STATUS_ON) или смену статуса ПК
+
+        Args:
+            mac (str): MAC-адрес ПК
+            status (str): Статус из fleet
+            boot_time (float | None): Время загрузки ПК из heartbeat'а
+            now (float | None): Момент замера (по умолчанию - текущее время)
+        """
+        now = time.time() if now is None else now
+        machine = self._machines.get(mac)
+        if machine is None:
+            machine = self._machines[mac] = _Machine(self.ring_size)
+        previous = machine.recent[-1] if machine.recent else None
+        machine.recent.append(Sample(now, status, boot_time))
+        changed = previous is None or previous.status != status
+
+        if status == STATUS_ON:
+            self._bucket(mac, now)[1] += 1
+            if not changed and (self.max_gap is None or now - previous.time <= self.max_gap):
+                self._add_on_time(mac, previous.time, now)
+            if boot_time and self._is_new_boot(machine, boot_time):
+                self._bucket(mac, boot_time)[3] += 1
+            if boot_time:
+                machine.boot_time = boot_time
+        if changed:
+            self._bucket(mac, now)[2] += 1
+
+        if changed or now - machine.last_stored >= self.sample_interval:
+            if len(self._pending) >= self.max_pending:
+                # База долго недоступна: сводки важнее сырых замеров
+                self.dropped += 1
+                return
+            machine.last_stored = now
+            self._pending.append((mac, now, status, boot_time))
+
+    def _is_new_boot(self, machine: _Machine, boot_time: float) -> bool:
+        if machine.boot_time is None:
+            # После запуска бота считаем только загрузки, случившиеся при нем
+            return boot_time > self.started
+        return abs(boot_time - machine.boot_time) > BOOT_TOLERANCE
+
+    def _bucket(self, mac: str, timestamp: float) -> list:
+        key = (mac, int(timestamp // HOUR) * HOUR)
+        bucket = self._hourly.get(key)
+        if bucket is None:
+            bucket = self._hourly[key] = [0.0, 0, 0, 0]
+        return bucket
+
+    def _add_on_time(self, mac: str, start: float, end: float):
+        # Интервал может пересекать границу часа
+        while start < end:
+            stop = min(end, (start // HOUR + 1) * HOUR)
+            self._bucket(mac, start)[0] += stop - start
+            start = stop
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS samples ('
+            'mac TEXT NOT NULL, time REAL NOT NULL, status TEXT NOT NULL, boot_time REAL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS samples_time ON samples (time)')
+        for table, key in (('hourly', 'hour'), ('daily', 'day')):
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                f'mac TEXT NOT NULL, {key} INTEGER NOT NULL, on_seconds REAL NOT NULL, '
+                f'heartbeats INTEGER NOT NULL, transitions INTEGER NOT NULL, boots INTEGER NOT NULL, '
+                f'PRIMARY KEY (mac, {key}))'
+            )
+
+    def _write(self, samples: list, hourly: dict, compact_at: float = None):
+        connection = self._connect()
+        with connection:
+            connection.executemany('INSERT INTO samples (mac, time, status, boot_time) VALUES (?, ?, ?, ?)',
+                                   samples)
+            connection.executemany(_UPSERT.format(table='hourly', key='hour'),
+                                   [(mac, hour, *values) for (mac, hour), values in hourly.items()])
+            if compact_at is not None:
+                self._compact(connection, compact_at)
+
+    def _compact(self, connection: sqlite3.Connection, now: float):
+        """Удаляет старые замеры и сворачивает старые часовые сводки в суточные"""
+        connection.execute('DELETE FROM samples WHERE time < ?', (now - self.raw_retention,))
+        # Сворачиваются только целые сутки
+        cutoff = day_start(now - self.hourly_retention)
+        days = {}
+        rows = connection.execute(
+            'SELECT mac, hour, on_seconds, heartbeats, transitions, boots FROM hourly WHERE hour < ?', (cutoff,))
+        for mac, hour, *values in rows:
+            _add(days.setdefault((mac, day_start(hour)), [0.0, 0, 0, 0]), values)
+        connection.executemany(_UPSERT.format(table='daily', key='day'),
+                               [(mac, day, *values) for (mac, day), values in days.items()])
+        connection.execute('DELETE FROM hourly WHERE hour < ?', (cutoff,))
+        connection.execute('DELETE FROM daily WHERE day < ?', (now - self.daily_retention,))
+
+    def _take_changes(self):
+        if not self._pending and not self._hourly:
+            return None
+        samples, self._pending = self._pending, []
+        hourly, self._hourly = self._hourly, {}
+        return samples, hourly
+
+    def _restore(self, samples: list, hourly: dict, compact_at: float = None):
+        # Запись не удалась: вернуть изменения, не потеряв накопленные за это время
+        self._pending[:0] = samples[:max(0, self.max_pending - len(self._pending))]
+        for (mac, hour), values in hourly.items():
+            _add(self._bucket(mac, hour), values)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией; раз в час уплотняет базу"""
+        async with self._lock:
+            now = time.time()
+            compact_at = now if now - self._last_compaction >= HOUR else None
+            changes = self._take_changes()
+            if changes is None and compact_at is None:
+                return
+            samples, hourly = changes or ([], {})
+            if await self._write_async(samples, hourly, compact_at) and compact_at is not None:
+                self._last_compaction = now
+
+    def _query(self, start: float, end: float) -> list:
+        connection = self._connect()
+        rows = connection.execute(
+            'SELECT mac, hour, on_seconds, heartbeats, transitions, boots FROM hourly '
+            'WHERE hour >= ? AND hour < ?', (start, end)).fetchall()
+        rows += connection.execute(
+            'SELECT mac, day, on_seconds, heartbeats, transitions, boots FROM daily '
+            'WHERE day >= ? AND day < ?', (start, end)).fetchall()
+        return rows
+
+    async def rollup(self, start: float, end: float = None) -> dict:
+        """
+        Сводки ПК по местным суткам за период [start, end)
+
+        Часовые сводки, уже свернутые в суточные, входят в период целыми сутками
+
+        Returns:
+            dict: {MAC-адрес: {начало суток: Rollup}}
+        """
+        end = time.time() + HOUR if end is None else end
+        async with self._lock:
+            rows = await asyncio.get_running_loop().run_in_executor(None, self._query, start, end)
+        # Еще не записанные приращения
+        rows += [(mac, hour, *values) for (mac, hour), values in self._hourly.items() if start <= hour < end]
+
+        totals = {}
+        for mac, period, *values in rows:
+            _add(totals.setdefault(mac, {}).setdefault(day_start(period), [0.0, 0, 0, 0]), values)
+        return {
+            mac: {day: Rollup(*values) for day, values in sorted(days.items())}
+            for mac, days in totals.items()
+        }
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
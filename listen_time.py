@@ -1,8 +1,12 @@
-import socket
+import asyncio
+import json
+import logging
 import os
+import socket
 from dotenv import load_dotenv
 
-from network import get_ip_mac_address
+from udp_io import DatagramReceiver, use_selector_event_loop
+from heartbeat import decode_binary, from_json
 
 load_dotenv()
 
@@ -13,36 +17,103 @@ if PORT is None:
     raise ValueError('PORT environment variable is not set')
 PORT = int(PORT)
 
-async def run_udp_port_listener_time(port: int, interface_name: str):
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatListener:
     """
-    Основная функция - слушает время, для отправки в сообщения
-    
-    Args:
-        port (int): UDP порт для прослушивания
-        interface_name (str): Имя сетевого интерфейса
+    Долгоживущий UDP-слушатель пакетов времени работы ПК.
+
+    Сокет создается и привязывается один раз и опрашивается через
+    loop.add_reader: ожидающие датаграммы (не больше DRAIN_LIMIT за
+    пробуждение) принимаются в общий буфер DatagramReceiver и разбираются
+    прямо из memoryview. Принимаются
+    бинарные heartbeat'ы и старый JSON-формат; в очередь кладется
+    разобранный heartbeat.Heartbeat как (heartbeat, addr).
+    """
+
+    def __init__(self, queue: asyncio.Queue, max_size: int = 1024):
+        self.queue = queue
+        self.receiver = DatagramReceiver(max_size)
+        self.sock = None
+        self._loop = None
+
+    def start(self, port: int, host: str = ''):
+        self._loop = asyncio.get_running_loop()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind((host, port))
+        self._loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self.sock is None:
+            return
+        self._loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        logger.info(f"Слушатель времени остановлен, счетчики: {self.receiver.stats()}")
+
+    def _on_readable(self):
+        try:
+            self.receiver.drain(self.sock, self._handle)
+        except OSError as e:
+            logger.error(f"Ошибка UDP-сокета слушателя времени: {e}")
+
+    def _handle(self, view: memoryview, addr) -> bool:
+        heartbeat = decode_binary(view)
+        if heartbeat is None:
+            # Старый формат - JSON-объект; все остальное отбрасываем, не декодируя
+            if not view or view[0] != 0x7B:
+                return False
+            try:
+                data_dict = json.loads(str(view, 'utf-8'))
+            except ValueError as e:
+                logger.error(f"Ошибка при обработке данных UDP от {addr}: {e}", extra={'event': 'bad_packet'})
+                return False
+            if not isinstance(data_dict, dict):
+                return False
+            heartbeat = from_json(data_dict)
+            if heartbeat is None:
+                logger.warning(f"Поле неверного типа в пакете от {addr}", extra={'event': 'bad_packet'})
+                return False
+
+        try:
+            self.queue.put_nowait((heartbeat, addr))
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь heartbeat переполнена, пакет от {addr} отброшен", extra={'event': 'queue_full'})
+            return False
+        return True
+
+
+async def start_time_listener(port: int, queue: asyncio.Queue, host: str = ''):
     """
-    # Получаем IP и MAC адрес интерфейса
-    ip_addr, mac_addr = get_ip_mac_address(interface_name)
+    Создает постоянный UDP-слушатель времени работы ПК
 
-    # Создаем UDP сокет
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_socket.bind(('', port))
-    print(1)
-    # Бесконечный цикл прослушивания
-    while True:
+    Args:
+        port (int): UDP порт для прослушивания
+        queue (asyncio.Queue): Очередь для разобранных heartbeat'ов
+        host (str): Адрес для привязки (по умолчанию - все интерфейсы)
 
-        # Получаем данные из сокета
-        data, _ = server_socket.recvfrom(1024)
-        decoded_packet_data = '-'.join(f'{byte:02x}' for byte in data).upper() + '-'
-        print(data)
-        return data, decoded_packet_data
+    Returns:
+        HeartbeatListener: Слушатель, который нужно закрыть при остановке
+    """
+    listener = HeartbeatListener(queue)
+    listener.start(port, host)
+    logger.info(f"Слушатель времени запущен на порту {port}")
+    return listener
 
 
 if __name__ == '__main__':
     print(INTERFACE)
-    import asyncio
+
     async def main():
-        while True:
-            data, _ = await run_udp_port_listener_time(PORT, INTERFACE)
-            print(data)
-    asyncio.run(main())
\ No newline at end of file
+        queue = asyncio.Queue()
+        listener = await start_time_listener(PORT, queue)
+        try:
+            while True:
+                heartbeat, addr = await queue.get()
+                print(addr, heartbeat, listener.receiver.stats())
+        finally:
+            listener.close()
+    use_selector_event_loop()
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+# Адаптивный детектор отказа (phi accrual) для heartbeat'ов ПК
+
+import math
+from collections import deque
+
+
+def phi_to_z(threshold: float) -> float:
+    """
+    Переводит уровень подозрения phi в число стандартных отклонений:
+    phi = -log10(P(интервал > t)), для нормального распределения
+    P = 10^-phi соответствует квантилю z
+    """
+    # Обратная функция к 0.5 * erfc(z / sqrt(2)) методом бисекции: в отличие от
+    # NormalDist.inv_cdf(1 - p) не теряет точность при больших phi
+    target = 10.0 ** -threshold
+    low, high = 0.0, 40.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if 0.5 * math.erfc(middle / math.sqrt(2)) > target:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+class PhiAccrualDetector:
+    """
+    Детектор отказа одного ПК по интервалам между heartbeat'ами.
+
+    Последние window интервалов хранятся в кольцевом буфере вместе с
+    суммой и суммой квадратов, так что среднее и отклонение пересчитываются
+    за O(1). Распределение интервалов считается нормальным; ПК считается
+    выключенным, когда уровень подозрения phi достигает порога, то есть
+    через mean + acceptable_pause + z * std после последнего heartbeat'а,
+    но не раньше min_timeout. Пока интервалов меньше min_samples,
+    используется fallback_timeout.
+
+    Таймаут сам по себе не сбрасывает последний heartbeat: если агент
+    перешел на более редкие heartbeat'ы, следующий интервал попадет в
+    распределение, и таймаут подстроится. Интервалы длиннее outlier_factor
+    текущих таймаутов - это простой ПК, а не разброс, и не учитываются.
+    """
+
+    __slots__ = ('window', 'min_samples', 'min_std', 'acceptable_pause', 'fallback_timeout',
+                 'min_timeout', 'outlier_factor', 'z', 'intervals', 'total', 'total_sq', 'last')
+
+    def __init__(self, z: float, window: int = 50, min_samples: int = 5, min_std: float = 1.0,
+                 acceptable_pause: float = 2.0, fallback_timeout: float = 10.0, min_timeout: float = 0.0,
+                 outlier_factor: float = 10.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.fallback_timeout = fallback_timeout
+        self.min_timeout = min_timeout
+        self.outlier_factor = outlier_factor
+        self.z = z
+        self.intervals = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.last = None
+
+    def heartbeat(self, now: float):
+        """Учитывает heartbeat, пришедший в момент now"""
+        if self.last is not None and now - self.last <= self.outlier_factor * self.timeout():
+            interval = now - self.last
+            if len(self.intervals) == self.window:
+                oldest = self.intervals[0]
+                self.total -= oldest
+                self.total_sq -= oldest * oldest
+            self.intervals.append(interval)
+            self.total += interval
+            self.total_sq += interval * interval
+        self.last = now
+
+    def reset(self):
+        """
+        Забывает последний heartbeat (агент сообщил о выключении или сне):
+        интервал до следующего включения не относится к распределению
+        """
+        self.last = None
+
+    def mean_std(self) -> tuple:
+        count = len(self.intervals)
+        mean = self.total / count
+        variance = max(0.0, self.total_sq / count - mean * mean)
+        return mean, max(math.sqrt(variance), self.min_std)
+
+    def timeout(self) -> float:
+        """Сколько секунд после последнего heartbeat'а ПК еще считается включенным"""
+        if len(self.intervals) < self.min_samples:
+            return self.fallback_timeout
+        mean, std = self.mean_std()
+        return max(self.min_timeout, mean + self.acceptable_pause + self.z * std)
+
+    def deadline(self) -> float:
+        """Момент, когда phi достигнет порога"""
+        return self.last + self.timeout()
+
+    def phi(self, now: float) -> float:
+        """Текущий уровень подозрения (0 - heartbeat только что пришел)"""
+        if self.last is None or len(self.intervals) < self.min_samples:
+            return 0.0
+        if now - self.last < self.min_timeout:
+            return 0.0
+        mean, std = self.mean_std()
+        elapsed = now - self.last - self.acceptable_pause
+        probability = 0.5 * math.erfc((elapsed - mean) / (std * math.sqrt(2)))
+        return -math.log10(max(probability, 1e-300))
+
+
+class LivenessTracker:
+    """Детекторы всего парка по MAC-адресу с общими настройками"""
+
+    def __init__(self, threshold: float = 8.0, **settings):
+        self.threshold = threshold
+        self.z = phi_to_z(threshold)
+        self.settings = settings
+        self.detectors = {}
+
+    def __len__(self):
+        return len(self.detectors)
+
+    def get(self, mac: str) -> PhiAccrualDetector:
+        detector = self.detectors.get(mac)
+        if detector is None:
+            detector = self.detectors[mac] = PhiAccrualDetector(self.z, **self.settings)
+        return detector
+
+    def heartbeat(self, mac: str, now: float) -> float:
+        """
+        Учитывает heartbeat ПК
+
+        Returns:
+            float: Новый дедлайн, после которого ПК считается выключенным
+        """
+        detector = self.get(mac)
+        detector.heartbeat(now)
+        return detector.deadline()
+
+    def reset(self, mac: str):
+        detector = self.detectors.get(mac)
+        if detector is not None:
+            detector.reset()
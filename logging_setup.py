@@ -0,0 +1,157 @@
+# Логирование бота без блокировки цикла событий: записи уходят в очередь,
+# а в файл и на консоль их пишет отдельный поток QueueListener
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Поля, которые можно передать через extra={...} и которые попадают в вывод
+STRUCTURED_FIELDS = ('event', 'user', 'mac', 'latency')
+
+# События, которые могут повторяться лавиной (битые пакеты, чужие отправители,
+# лимиты Telegram); их записи ограничиваются на любом уровне
+REPETITIVE_EVENTS = frozenset({
+    'bad_heartbeat', 'bad_packet', 'unknown_sender', 'queue_full', 'telegram_retry_after', 'auth_denied',
+})
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Текстовый формат с полями key=value после сообщения или JSON по строке
+    на запись (fmt='json')
+    """
+
+    def __init__(self, fmt: str = 'text'):
+        super().__init__('%(asctime)s [%(levelname)s] %(message)s')
+        self.json = fmt == 'json'
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {name: getattr(record, name) for name in STRUCTURED_FIELDS
+                  if getattr(record, name, None) is not None}
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            fields['suppressed'] = suppressed
+
+        if self.json:
+            data = {
+                'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+            }
+            data.update(fields)
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+        line = super().format(record)
+        if fields:
+            line += ' | ' + ' '.join(f'{name}={value}' for name, value in fields.items())
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Ограничивает повторяющиеся записи: из одного места кода (или с одним
+    event) для одного пользователя и ПК проходит не больше burst записей
+    за interval секунд. Число отброшенных записей добавляется к следующей
+    пропущенной (поле suppressed).
+
+    Ограничиваются только записи ниже WARNING и записи с event из
+    repetitive: предупреждения и ошибки библиотек и сбои отправки проходят
+    всегда. Окна, которые больше не нужны, удаляются раз в interval.
+    """
+
+    def __init__(self, interval: float = 60.0, burst: int = 10, repetitive=REPETITIVE_EVENTS):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.repetitive = repetitive
+        self._windows = {}
+        self._pruned = time.monotonic()
+        # Записи приходят и из потоков исполнителя
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if record.levelno >= logging.WARNING and event not in self.repetitive:
+            return True
+        key = (event or (record.pathname, record.lineno),
+               getattr(record, 'user', None), getattr(record, 'mac', None))
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned >= self.interval:
+                self._prune(now)
+            return self._admit(key, record, now)
+
+    def _prune(self, now: float):
+        # Закончившиеся окна без отброшенных записей не нужны; счетчик
+        # отброшенных забывается, если место молчит дольше 10 окон
+        self._pruned = now
+        stale = [key for key, window in self._windows.items()
+                 if now - window[0] >= self.interval and (not window[2] or now - window[0] >= 10 * self.interval)]
+        for key in stale:
+            del self._windows[key]
+
+    def _admit(self, key, record: logging.LogRecord, now: float) -> bool:
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            # Новое окно: [начало, сколько пропущено, сколько отброшено]
+            window = self._windows[key] = [now, 0, window[2] if window else 0]
+        if window[1] >= self.burst:
+            window[2] += 1
+            self.suppressed += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record.suppressed = window[2]
+            window[2] = 0
+        return True
+
+
+def setup_logging(path: str = 'bot.log', level: int = logging.INFO, fmt: str = 'text',
+                  max_bytes: int = 5 * 1024 * 1024, backup_count: int = 5,
+                  rate_interval: float = 60.0, rate_burst: int = 10):
+    """
+    Настраивает корневой логгер: QueueHandler в потоке цикла событий,
+    QueueListener с консолью и RotatingFileHandler в фоновом потоке
+
+    Args:
+        path (str): Файл лога; None - только консоль
+        level (int): Уровень корневого логгера
+        fmt (str): 'text' или 'json'
+        max_bytes (int): Размер файла, после которого он ротируется
+        backup_count (int): Сколько старых файлов хранить
+        rate_interval (float): Окно ограничения повторяющихся записей, секунды
+        rate_burst (int): Сколько одинаковых записей пропускать за окно (0 - без ограничения)
+
+    Returns:
+        logging.handlers.QueueListener: Запущенный слушатель (останавливается при выходе)
+    """
+    formatter = StructuredFormatter(fmt)
+    sinks = [logging.StreamHandler()]
+    if path:
+        sinks.append(logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    if rate_burst:
+        # Лишние записи отбрасываются еще до очереди
+        handler.addFilter(RateLimitFilter(rate_interval, rate_burst))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, *sinks, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
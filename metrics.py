@@ -0,0 +1,218 @@
+# Метрики с постоянным объемом памяти: гистограммы с фиксированными корзинами
+
+import asyncio
+import bisect
+import functools
+import time
+
+# Границы корзин по умолчанию для задержек в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Границы корзин для времени загрузки ПК в секундах
+BOOT_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+# Границы корзин для задержки цикла событий в секундах
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин.
+
+    Последняя корзина собирает все значения больше последней границы.
+    Перцентили оцениваются линейной интерполяцией внутри корзины.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float):
+        """
+        Оценивает перцентиль
+
+        Args:
+            q (float): Доля от 0 до 1 (0.5 - медиана)
+
+        Returns:
+            float | None: Оценка перцентиля или None, если значений нет
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                # Значения в корзине не больше наблюдавшегося максимума
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def summary(self) -> dict:
+        """Количество, среднее и основные перцентили"""
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max if self.count else None,
+        }
+
+    def prometheus(self, name: str, labels: dict = None) -> list:
+        """Строки гистограммы в текстовом формате Prometheus (корзины накопительные)"""
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{_labels(labels)} {self.count}')
+        return lines
+
+
+def _labels(labels: dict = None, **extra) -> str:
+    items = dict(labels or {}, **extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items.items()) + '}'
+
+
+class MetricsRegistry:
+    """
+    Именованные гистограммы и счетчики с метками.
+
+    Набор меток ограничен (обработчики, MAC-адреса известных ПК), поэтому
+    память не растет со временем работы. Значения, которые уже считают
+    другие объекты (диспетчер, слушатель), подключаются через add_collector.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+
+    def histogram(self, name: str, labels: dict = None, bounds=LATENCY_BUCKETS) -> Histogram:
+        """Возвращает гистограмму по имени и меткам, создавая ее при первом обращении"""
+        key = (name, tuple(sorted((labels or {}).items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(bounds)
+        return histogram
+
+    def inc(self, name: str, labels: dict = None, value: int = 1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_collector(self, collector):
+        """
+        Подключает функцию collector() -> [(имя, метки, значение)], которая
+        вызывается при каждом снятии метрик
+        """
+        self._collectors.append(collector)
+
+    def histograms(self):
+        """Перебирает (имя, метки, гистограмма)"""
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            yield name, dict(labels), histogram
+
+    def counters(self):
+        """Перебирает собственные счетчики: (имя, метки, значение)"""
+        for (name, labels), value in sorted(self._counters.items()):
+            yield name, dict(labels), value
+
+    def gauges(self):
+        """Перебирает значения подключенных сборщиков: (имя, метки, значение)"""
+        for collector in self._collectors:
+            yield from collector()
+
+    def render_prometheus(self, prefix: str = '') -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {prefix}{name} {kind}')
+
+        for name, labels, histogram in self.histograms():
+            declare(name, 'histogram')
+            lines.extend(histogram.prometheus(prefix + name, labels))
+        for kind, values in (('counter', self.counters()), ('gauge', self.gauges())):
+            for name, labels, value in values:
+                declare(name, kind)
+                lines.append(f'{prefix}{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram: Histogram):
+    """Декоратор корутины: время каждого вызова пишется в гистограмму"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(histogram: Histogram, interval: float = 0.25):
+    """
+    Измеряет задержку цикла событий: насколько позже запланированного
+    просыпается asyncio.sleep(interval). Запускается отдельной задачей
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, loop.time() - expected))
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str, port: int, prefix: str = ''):
+    """
+    Запускает HTTP-сервер, который на любой GET отдает метрики в формате
+    Prometheus
+
+    Returns:
+        asyncio.Server: Сервер, который нужно закрыть при остановке
+    """
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не нужны, дочитываем до пустой строки
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if request_line.startswith(b'GET '):
+                body = registry.render_prometheus(prefix).encode()
+                writer.write(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                             b'Connection: close\r\n\r\n' + body)
+            else:
+                writer.write(b'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(serve, host, port)
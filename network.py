@@ -1,37 +1,319 @@
 
-import psutil
+import ipaddress
+import logging
+import socket
+import struct
+import sys
+import time
 
+logger = logging.getLogger(__name__)
 
-def get_ip_mac_address(interface_name: str) -> tuple:
+# Семейство адресов канального уровня (MAC): AF_LINK на BSD/macOS,
+# AF_PACKET на Linux, -1 на Windows - так же, как psutil.AF_LINK
+AF_LINK = getattr(socket, 'AF_LINK', getattr(socket, 'AF_PACKET', -1))
+
+# rtnetlink (Linux): типы сообщений, группы рассылки и атрибуты адреса
+NETLINK_ROUTE = 0
+RTM_NEWLINK, RTM_DELLINK = 16, 17
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+NLM_F_REQUEST, NLM_F_DUMP = 0x1, 0x300
+IFA_ADDRESS, IFA_LOCAL = 1, 2
+
+NLMSG_HEADER = struct.Struct('=IHHII')  # len, type, flags, seq, pid
+IFADDRMSG = struct.Struct('=BBBBI')     # family, prefixlen, flags, scope, index
+IFINFOMSG = struct.Struct('=BxHiII')    # family, type, index, flags, change
+RTATTR = struct.Struct('=HH')           # len, type
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _iter_netlink(data: bytes):
+    """Перебирает сообщения netlink в буфере: (type, payload)"""
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            return
+        yield msg_type, data[offset + NLMSG_HEADER.size:offset + length]
+        offset += _align(length)
+
+
+def _ipv4_from_ifaddrmsg(payload: bytes) -> str:
+    """Достает IPv4-адрес из RTM_NEWADDR (IFA_LOCAL, иначе IFA_ADDRESS)"""
+    found = {}
+    offset = IFADDRMSG.size
+    while offset + RTATTR.size <= len(payload):
+        length, attr_type = RTATTR.unpack_from(payload, offset)
+        if length < RTATTR.size:
+            break
+        if attr_type in (IFA_ADDRESS, IFA_LOCAL) and length == RTATTR.size + 4:
+            found[attr_type] = socket.inet_ntoa(payload[offset + RTATTR.size:offset + length])
+        offset += _align(length)
+    return found.get(IFA_LOCAL) or found.get(IFA_ADDRESS)
+
+
+def _get_addresses_linux(interface_name: str) -> dict:
     """
-    Получает IP и MAC адрес указанного сетевого интерфейса
-    
+    Адреса интерфейса средствами стандартной библиотеки (Linux):
+    MAC читается из /sys/class/net, все IPv4-адреса - дампом RTM_GETADDR
+
+    Raises:
+        OSError: Если интерфейса нет или netlink недоступен
+    """
+    with open(f'/sys/class/net/{interface_name}/address', encoding='ascii') as f:
+        mac_addr = f.read().strip()
+    index = socket.if_nametoindex(interface_name)
+
+    ipv4 = []
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        sock.settimeout(1.0)
+        request = IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), RTM_GETADDR,
+                                   NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.send(header + request)
+        done = False
+        while not done:
+            for msg_type, payload in _iter_netlink(sock.recv(65536)):
+                if msg_type in (NLMSG_DONE, NLMSG_ERROR):
+                    done = True
+                    break
+                if msg_type != RTM_NEWADDR or len(payload) < IFADDRMSG.size:
+                    continue
+                family, _, _, _, addr_index = IFADDRMSG.unpack_from(payload)
+                if family == socket.AF_INET and addr_index == index:
+                    address = _ipv4_from_ifaddrmsg(payload)
+                    if address:
+                        ipv4.append(address)
+
+    return {socket.AF_INET: tuple(ipv4), AF_LINK: (mac_addr,)}
+
+
+def _get_addresses_psutil(interface_name: str) -> dict:
+    # psutil импортируется только здесь: на Linux он обычно не нужен
+    import psutil
+
+    addresses = {socket.AF_INET: [], AF_LINK: []}
+    # Адреса разбираются по семейству, а не по разделителям в строке
+    for item in psutil.net_if_addrs()[interface_name]:
+        if item.family == socket.AF_INET:
+            addresses[socket.AF_INET].append(item.address)
+        elif item.family == psutil.AF_LINK:
+            addresses[AF_LINK].append(item.address)
+    return {family: tuple(values) for family, values in addresses.items()}
+
+
+def get_addresses(interface_name: str) -> dict:
+    """
+    Получает адреса сетевого интерфейса по семействам
+
     Args:
         interface_name (str): Имя сетевого интерфейса
-        
+
     Returns:
-        tuple: (ip_address, mac_address) - кортеж с IP и MAC адресами
-        
-    Raises:
-        Exception: Если не удалось получить адреса
+        dict: {socket.AF_INET: (ipv4, ...), AF_LINK: (mac, ...)};
+            MAC-адреса приведены к виду 'XX-XX-XX-XX-XX-XX'
     """
-    ip_addr = mac_addr = None
+    addresses = None
+    if sys.platform.startswith('linux'):
+        try:
+            addresses = _get_addresses_linux(interface_name)
+        except OSError as e:
+            logger.debug(f'netlink недоступен для {interface_name}: {e}')
+    if addresses is None:
+        addresses = _get_addresses_psutil(interface_name)
 
-    # Перебираем все адреса указанного интерфейса
-    for item in psutil.net_if_addrs()[interface_name]:
-        addr = item.address
+    # Приводим MAC-адрес к одному формату. Формат может меняться в зависимости от ОС
+    addresses[AF_LINK] = tuple(mac.replace(':', '-').upper() for mac in addresses[AF_LINK] if mac)
+    return addresses
+
+
+def select_address(addresses, prefer: str = None) -> str:
+    """
+    Выбирает один IPv4-адрес из нескольких адресов интерфейса
+
+    Args:
+        addresses: IPv4-адреса интерфейса
+        prefer (str): Конкретный адрес или сеть ('192.168.50.0/24');
+            без него берется первый адрес, кроме 127.0.0.1
+
+    Returns:
+        str: Выбранный адрес или None
+    """
+    if prefer:
+        network = ipaddress.ip_network(prefer, strict=False)
+        for address in addresses:
+            if ipaddress.ip_address(address) in network:
+                return address
+        return None
+    for address in addresses:
+        if address != '127.0.0.1':
+            return address
+    return None
 
-        # В IPv4-адресах разделители - точки
-        if '.' in addr:
-            ip_addr = addr
-        # В MAC-адресах разделители либо тире, либо одинарное двоеточие.
-        # Двойное двоеточие - это разделители для адресов IPv6
-        elif ('-' in addr or ':' in addr) and '::' not in addr:
-            # Приводим MAC-адрес к одному формату. Формат может меняться в зависимости от ОС
-            mac_addr = addr.replace(':', '-').upper()
+
+def _pick_ip_mac(addresses: dict, prefer: str = None) -> tuple:
+    ip_addr = select_address(addresses.get(socket.AF_INET, ()), prefer)
+    macs = addresses.get(AF_LINK, ())
+    mac_addr = macs[0] if macs else None
 
     # Проверяем, что получили валидные адреса
-    if not ip_addr or not mac_addr or ip_addr == '127.0.0.1':
+    if not ip_addr or not mac_addr:
         raise Exception('Не удалось получить IP или MAC-адрес сетевого интерфейса')
 
-    return ip_addr, mac_addr
\ No newline at end of file
+    return ip_addr, mac_addr
+
+
+def _open_netlink_watch():
+    """Неблокирующий сокет, подписанный на изменения интерфейсов и IPv4-адресов"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class InterfaceResolver:
+    """
+    Кэш адресов сетевого интерфейса.
+
+    Адреса перечитываются только после реального изменения: на Linux об
+    этом сообщает rtnetlink (сокет watch_socket можно зарегистрировать в
+    selector'е), на остальных ОС кэш просто живет ttl секунд. poll()
+    возвращает True, когда выбранный адрес или MAC изменились - по этому
+    сигналу слушатели пересоздают свои сокеты.
+    """
+
+    def __init__(self, interface_name: str, prefer: str = None, ttl: float = 30.0):
+        self.interface_name = interface_name
+        self.prefer = prefer
+        self.ttl = ttl
+        self.watch_socket = None
+        self._addresses = None
+        self._selected = None
+        self._index = None
+        self._expires = 0.0
+        self.refreshes = 0
+        self.changes = 0
+
+        if sys.platform.startswith('linux'):
+            try:
+                self.watch_socket = _open_netlink_watch()
+            except OSError as e:
+                logger.warning(f'Не удалось подписаться на изменения адресов, кэш на {ttl} с: {e}')
+
+    def addresses(self, family: int) -> tuple:
+        """
+        Адреса интерфейса заданного семейства (socket.AF_INET или AF_LINK)
+        """
+        if self._addresses is None or (self.watch_socket is None and time.monotonic() >= self._expires):
+            self._refresh()
+        return self._addresses.get(family, ())
+
+    def resolve(self) -> tuple:
+        """
+        Возвращает выбранный IPv4-адрес и MAC интерфейса из кэша
+
+        Returns:
+            tuple: (ip_address, mac_address)
+
+        Raises:
+            Exception: Если у интерфейса нет подходящего адреса
+        """
+        self.addresses(socket.AF_INET)
+        self._selected = _pick_ip_mac(self._addresses, self.prefer)
+        return self._selected
+
+    def poll(self) -> bool:
+        """
+        Проверяет, не изменились ли адреса (без блокировки)
+
+        Returns:
+            bool: True, если выбранный адрес или MAC изменились с последнего resolve()
+        """
+        if self.watch_socket is not None:
+            if not self._drain_events():
+                return False
+            self.invalidate()
+        elif time.monotonic() < self._expires:
+            return False
+
+        previous = self._selected
+        try:
+            current = self.resolve()
+        except Exception as e:
+            logger.warning(f'Интерфейс {self.interface_name} недоступен: {e}')
+            self.invalidate()
+            return False
+        if current == previous:
+            return False
+        self.changes += 1
+        logger.info(f'Адрес интерфейса {self.interface_name} изменился: {previous} -> {current}')
+        return True
+
+    def invalidate(self):
+        """Сбрасывает кэш: следующий запрос перечитает адреса"""
+        self._addresses = None
+
+    def close(self):
+        if self.watch_socket is not None:
+            self.watch_socket.close()
+            self.watch_socket = None
+
+    def _refresh(self):
+        self._addresses = get_addresses(self.interface_name)
+        self._expires = time.monotonic() + self.ttl
+        self.refreshes += 1
+        try:
+            self._index = socket.if_nametoindex(self.interface_name)
+        except OSError:
+            self._index = None
+
+    def _drain_events(self) -> bool:
+        """Читает все ожидающие события netlink; True, если касаются нашего интерфейса"""
+        relevant = False
+        while True:
+            try:
+                data = self.watch_socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return relevant
+            except OSError as e:
+                # Например, ENOBUFS: события потеряны, перечитываем на всякий случай
+                logger.debug(f'Ошибка чтения netlink: {e}')
+                return True
+            for msg_type, payload in _iter_netlink(data):
+                if msg_type in (RTM_NEWADDR, RTM_DELADDR) and len(payload) >= IFADDRMSG.size:
+                    index = IFADDRMSG.unpack_from(payload)[4]
+                elif msg_type in (RTM_NEWLINK, RTM_DELLINK) and len(payload) >= IFINFOMSG.size:
+                    index = IFINFOMSG.unpack_from(payload)[2]
+                else:
+                    continue
+                if self._index is None or index == self._index:
+                    relevant = True
+
+
+def get_ip_mac_address(interface_name: str, prefer: str = None) -> tuple:
+    """
+    Получает IP и MAC адрес указанного сетевого интерфейса
+
+    Разовый запрос без кэша; агенту, который работает долго, лучше
+    держать InterfaceResolver.
+
+    Args:
+        interface_name (str): Имя сетевого интерфейса
+        prefer (str): Адрес или сеть, если у интерфейса несколько IPv4-адресов
+
+    Returns:
+        tuple: (ip_address, mac_address) - кортеж с IP и MAC адресами
+
+    Raises:
+        Exception: Если не удалось получить адреса
+    """
+    return _pick_ip_mac(get_addresses(interface_name), prefer)
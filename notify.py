@@ -0,0 +1,231 @@
+# Рассылка обновлений пользователям Telegram с ограничением частоты
+
+import asyncio
+import heapq
+import logging
+import time
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - важнее
+PRIORITY_TRANSITION = 0  # ПК включился / выключился
+PRIORITY_REFRESH = 1     # Обновление времени работы
+
+
+class TokenBucket:
+    """Глобальный лимит запросов: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена (0 - можно отправлять)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Останавливает отправку на seconds секунд (ответ 429 от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class _Job:
+    __slots__ = ('key', 'chat_id', 'send', 'priority', 'seq', 'queued')
+
+    def __init__(self, key, chat_id, send, priority):
+        self.key = key
+        self.chat_id = chat_id
+        self.send = send
+        self.priority = priority
+        self.seq = 0
+        self.queued = False
+
+
+class EditDispatcher:
+    """
+    Параллельная рассылка запросов к Telegram.
+
+    - глобальный token bucket (лимит Telegram ~30 сообщений в секунду);
+    - не больше одного запроса в чат за per_chat_interval секунд;
+    - переходы статуса идут раньше обновлений времени работы;
+    - ожидающий запрос для чата заменяется более новым (схлопывание),
+      так что в очереди на чат никогда не больше одного запроса каждого вида.
+    """
+
+    def __init__(self, rate: float = 25.0, burst: float = 25.0,
+                 per_chat_interval: float = 1.0, concurrency: int = 8):
+        self.per_chat_interval = per_chat_interval
+        self._bucket = TokenBucket(rate, burst)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._heap = []
+        self._seq = 0
+        self._pending = {}
+        self._blocked = {}
+        self._busy = set()
+        self._tasks = set()
+        self.sent = 0
+        self.collapsed = 0
+        self.failed = 0
+        # Время ответа Telegram на каждый запрос
+        self.send_time = Histogram()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, chat_id, send, priority: int = PRIORITY_REFRESH, kind: str = 'edit'):
+        """
+        Ставит запрос в очередь
+
+        Args:
+            chat_id: Идентификатор чата (для лимита на чат)
+            send: Функция без аргументов, возвращающая корутину запроса
+            priority (int): PRIORITY_TRANSITION или PRIORITY_REFRESH
+            kind (str): Вид запроса; ожидающий запрос того же вида
+                для этого чата заменяется новым
+        """
+        key = (chat_id, kind)
+        job = self._pending.get(key)
+        if job is None:
+            job = self._pending[key] = _Job(key, chat_id, send, priority)
+            self._push(job)
+            return
+
+        # Более новый запрос вытесняет ожидающий, приоритет сохраняется высший
+        self.collapsed += 1
+        job.send = send
+        if priority < job.priority:
+            job.priority = priority
+            if job.queued:
+                self._push(job)
+
+    def _push(self, job: _Job):
+        self._seq += 1
+        job.seq = self._seq
+        job.queued = True
+        heapq.heappush(self._heap, (job.priority, job.seq, job.key))
+        self._wakeup.set()
+
+    def _pop_ready(self):
+        while self._heap:
+            _, seq, key = heapq.heappop(self._heap)
+            job = self._pending.get(key)
+            if job is None or job.seq != seq or not job.queued:
+                continue
+            job.queued = False
+            if job.chat_id in self._busy:
+                # Чат занят - запрос вернется в кучу, когда чат освободится
+                self._blocked.setdefault(job.chat_id, []).append(job)
+                continue
+            del self._pending[key]
+            return job
+        return None
+
+    def _release(self, chat_id):
+        self._busy.discard(chat_id)
+        for job in self._blocked.pop(chat_id, ()):
+            if self._pending.get(job.key) is job:
+                self._push(job)
+
+    async def run(self):
+        """Основной цикл рассылки, запускается отдельной задачей"""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            await self._slots.acquire()
+            job = self._pop_ready()
+            if job is None:
+                self._slots.release()
+                continue
+
+            self._bucket.take()
+            self._busy.add(job.chat_id)
+            task = asyncio.create_task(self._send(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, job: _Job):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await job.send()
+            self.sent += 1
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Лимит Telegram, пауза {retry_after} с (чат {job.chat_id})",
+                               extra={'event': 'telegram_retry_after', 'user': job.chat_id})
+                self._bucket.pause(retry_after)
+                # Повторяем, если за это время не пришел более новый запрос
+                if job.key not in self._pending:
+                    self.submit(job.chat_id, job.send, job.priority, job.key[1])
+            else:
+                self.failed += 1
+                logger.error(f"Ошибка при отправке пользователю {job.chat_id}: {e}",
+                             extra={'event': 'send_failed', 'user': job.chat_id})
+        finally:
+            self.send_time.observe(loop.time() - started)
+            self._slots.release()
+            ready_at = started + self.per_chat_interval
+            if ready_at > loop.time():
+                loop.call_at(ready_at, self._release, job.chat_id)
+            else:
+                self._release(job.chat_id)
+
+
+class RenderCache:
+    """
+    Последний отправленный в каждый чат текст и клавиатура.
+
+    Правка, которая не меняет видимое содержимое сообщения, отбрасывается
+    до обращения к сети.
+    """
+
+    def __init__(self):
+        self._last = {}
+        self.skipped = 0
+
+    def update(self, key, text: str, markup=None) -> bool:
+        """
+        Запоминает новое содержимое сообщения
+
+        Returns:
+            bool: True, если содержимое изменилось и правку нужно отправить
+        """
+        rendered = (text, markup)
+        if self._last.get(key) == rendered:
+            self.skipped += 1
+            return False
+        self._last[key] = rendered
+        return True
+
+    def forget(self, key):
+        """Сбрасывает запомненное содержимое (новое сообщение или ошибка отправки)"""
+        self._last.pop(key, None)
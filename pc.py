@@ -1,21 +1,49 @@
 # Скрипт для выключения компьютера при получении Wake-on-LAN пакета
-# Слушает UDP порт 9 и при получении правильного WoL пакета выключает систему
+# Слушает UDP порт 9 и при получении правильного WoL пакета выключает систему,
+# в том же потоке отправляет боту heartbeat'ы со временем работы
+
+# Агент запускается при загрузке ПК, поэтому тяжелые модули (psutil, json,
+# subprocess, dotenv) импортируются только когда действительно нужны
 
 import socket
 import os
+import sys
 import logging
-import psutil
 import time
-import json
-import threading
-from dotenv import load_dotenv
-from network import get_ip_mac_address
+import itertools
+import collections
+import selectors
+from network import InterfaceResolver
+from udp_io import DatagramReceiver
+from heartbeat import encode_heartbeat, KIND_HEARTBEAT, KIND_SHUTDOWN, KIND_SLEEP, KIND_ACK
+from heartbeat_schedule import HeartbeatScheduler
+
+
+def load_env():
+    """
+    Загружает переменные из .env (текущий каталог или каталог скрипта).
+    python-dotenv импортируется, только если файл есть
+    """
+    for directory in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        path = os.path.join(directory, '.env')
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+
 
-load_dotenv()
+load_env()
 
-SERVER_MAC_ADDRESS = os.getenv("SERVER_MAC_ADDRESS")
 BROADCAST_IP = os.getenv("BROADCAST_IP")
 INTERFACE_NAME = os.getenv("INTERFACE_NAME")  # Имя сетевого интерфейса для мониторинга
+# Адрес или сеть (например, 192.168.50.0/24), если у интерфейса несколько IPv4-адресов
+INTERFACE_ADDRESS = os.getenv("INTERFACE_ADDRESS")
+# Формат heartbeat'а: binary (18 байт) или json (для ботов старых версий)
+HEARTBEAT_FORMAT = os.getenv("HEARTBEAT_FORMAT", "binary").lower()
+# Интервал heartbeat'ов в установившемся режиме и сразу после загрузки/выхода из сна
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", 5))
+HEARTBEAT_FAST_INTERVAL = float(os.getenv("HEARTBEAT_FAST_INTERVAL", 1))
+HEARTBEAT_FAST_PERIOD = float(os.getenv("HEARTBEAT_FAST_PERIOD", 60))
 
 
 # Константы
@@ -23,106 +51,269 @@ WOL_PORT = 9  # Стандартный порт для Wake-on-LAN
 
 TIME_PORT = 59681 # Порт для отправки времени
 
+# Порядковый номер heartbeat'а
+heartbeat_seq = itertools.count(1)
+
+# Время загрузки системы (кэш get_boot_time)
+_boot_time = None
+
+# Пока monotonic() меньше этого значения, heartbeat'ы не отправляются
+# (агент уже объявил о выключении или сне)
+heartbeat_paused_until = 0.0
+
+# Сколько раз повторять уведомление о выключении/сне и с каким интервалом
+POWER_NOTICE_COPIES = 3
+POWER_NOTICE_GAP = 0.05
+
+# Сколько секунд молчать после команды сна или выключения, если ПК так и
+# не уснул или не выключился: потом heartbeat'ы возобновляются, и бот снова
+# показывает ПК включенным
+SLEEP_HEARTBEAT_PAUSE = 15
+OFF_HEARTBEAT_PAUSE = 60
+
+# Запущенная команда питания; ее результат проверяет цикл агента
+power_process = None
+
 # Настройка логирования
 logging.basicConfig(format='%(levelname)s: %(asctime)s %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 
-def assemble_off_packet(mac_address: str) -> str:
+# Размер командного пакета: 6 байт префикса + 16 повторений MAC-адреса
+PACKET_SIZE = 102
+# Пакет с подтверждением: те же 102 байта + 4 байта id команды (сетевой порядок)
+ACKED_PACKET_SIZE = PACKET_SIZE + 4
+
+# Сколько последних id команд помнить, чтобы не выполнять повторы
+RECENT_COMMANDS = 32
+
+# Команды, которые понимает агент, по байту магического префикса
+COMMAND_OFF = 'off'
+COMMAND_SLEEP = 'sleep'
+COMMAND_PREFIXES = {
+    0x00: COMMAND_OFF,
+    0x99: COMMAND_SLEEP,
+}
+
+
+def mac_to_bytes(mac_address: str) -> bytes:
+    """
+    Преобразует MAC-адрес в 6 байт
+
+    Args:
+        mac_address (str): MAC-адрес в формате XX-XX-XX-XX-XX-XX или XX:XX:XX:XX:XX:XX
+
+    Returns:
+        bytes: MAC-адрес в виде 6 байт
     """
-    Собирает строку Wake-on-LAN пакета для сравнения
+    return bytes.fromhex(mac_address.replace('-', '').replace(':', ''))
+
+
+def assemble_off_packet(mac_address: str) -> bytes:
+    """
+    Собирает пакет выключения для сравнения
     
-    WoL пакет состоит из:
-    - 6 байт 0xFF (магическая последовательность)
+    Пакет состоит из:
+    - 6 байт 0x00 (магическая последовательность выключения)
     - 16 повторений MAC-адреса (96 байт)
     
     Args:
         mac_address (str): MAC-адрес в формате XX-XX-XX-XX-XX-XX
         
     Returns:
-        str: Строка WoL пакета для сравнения
+        bytes: Ожидаемый пакет выключения
     """
-    return f'{"00-" * 6}{(mac_address + "-") * 16}'
+    return b'\x00' * 6 + mac_to_bytes(mac_address) * 16
 
 
-def assemble_sleep_packet(mac_address: str) -> str:
+def assemble_sleep_packet(mac_address: str) -> bytes:
     """
-    Собирает строку Wake-on-LAN пакета для сравнения
+    Собирает пакет перехода в сон для сравнения
     
-    WoL пакет состоит из:
-    - 6 байт 0xFF (магическая последовательность)
+    Пакет состоит из:
+    - 6 байт 0x99 (магическая последовательность сна)
     - 16 повторений MAC-адреса (96 байт)
     
     Args:
         mac_address (str): MAC-адрес в формате XX-XX-XX-XX-XX-XX
         
     Returns:
-        str: Строка WoL пакета для сравнения
+        bytes: Ожидаемый пакет сна
     """
-    return f'{"99-" * 6}{(mac_address + "-") * 16}'
+    return b'\x99' * 6 + mac_to_bytes(mac_address) * 16
 
-def check_is_wol_packet(raw_bytes: bytes, assembled_wol_packet: str) -> int:
+def check_is_wol_packet(raw_bytes: bytes, assembled_wol_packet: bytes) -> int:
     """
-    Проверяет, является ли полученный пакет Wake-on-LAN пакетом
+    Проверяет, совпадает ли полученный пакет с ожидаемым
     
     Args:
         raw_bytes (bytes): Сырые байты полученного пакета
-        assembled_wol_packet (str): Ожидаемый WoL пакет для сравнения
+        assembled_wol_packet (bytes): Ожидаемый пакет для сравнения
         
     Returns:
-        int: 1 если это WoL пакет, 0 если нет
+        int: 1 если пакеты совпадают, 0 если нет
     """
-    # Преобразуем байты в строку в формате XX-XX-XX-XX...
-    decoded_packet_data = '-'.join(f'{byte:02x}' for byte in raw_bytes).upper() + '-'
-
-    # Сравниваем с ожидаемым пакетом
-    if decoded_packet_data == assembled_wol_packet:
+    if len(raw_bytes) == PACKET_SIZE and raw_bytes == assembled_wol_packet:
         return 1
 
     return 0
 
-def run_udp_port_listener_lan(port: int, interface_name: str):
+
+def build_packet_table(mac_address: str) -> dict:
     """
-    Основная функция - слушает UDP порт и выключает компьютер при получении WoL пакета
-    
+    Собирает таблицу ожидаемых командных пакетов для этого ПК (один раз при запуске)
+
     Args:
-        port (int): UDP порт для прослушивания
-        interface_name (str): Имя сетевого интерфейса
+        mac_address (str): MAC-адрес в формате XX-XX-XX-XX-XX-XX
+
+    Returns:
+        dict: {первый байт префикса: (команда, ожидаемый пакет)}
+    """
+    payload = mac_to_bytes(mac_address) * 16
+    return {
+        prefix: (command, bytes([prefix]) * 6 + payload)
+        for prefix, command in COMMAND_PREFIXES.items()
+    }
+
+
+def classify_packet(data, packet_table: dict):
     """
-    # Получаем IP и MAC адрес интерфейса
-    ip_addr, mac_addr = get_ip_mac_address(interface_name)
+    Определяет команду в полученном пакете без преобразования в строки
+
+    Префиксы команд состоят из одного повторяющегося байта, поэтому
+    первый байт выбирает шаблон из таблицы, а одно сравнение байтов
+    проверяет и префикс, и все 16 копий MAC-адреса.
+
+    Пакет с подтверждением (ACKED_PACKET_SIZE) проверяется по первым
+    PACKET_SIZE байтам; id команды достает command_id.
+
+    Args:
+        data (bytes): Сырые байты полученного пакета
+        packet_table (dict): Таблица из build_packet_table
+
+    Returns:
+        str | None: COMMAND_OFF, COMMAND_SLEEP или None для чужих пакетов
+    """
+    if len(data) == ACKED_PACKET_SIZE:
+        data = data[:PACKET_SIZE]
+    elif len(data) != PACKET_SIZE:
+        return None
+    entry = packet_table.get(data[0])
+    if entry is None or data != entry[1]:
+        return None
+    return entry[0]
 
-    # Создаем UDP сокет
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_socket.bind((ip_addr, port))
-    logger.info(f'Listening on {ip_addr}:{port}')
 
-    # Собираем ожидаемый WoL пакет
-    assembled_off_packet = assemble_off_packet(mac_addr)
-    assembled_sleep_packet = assemble_sleep_packet(mac_addr)
+def command_id(data):
+    """
+    Возвращает id команды из пакета с подтверждением
+
+    Returns:
+        int | None: id команды или None для пакета без подтверждения
+    """
+    if len(data) != ACKED_PACKET_SIZE:
+        return None
+    return int.from_bytes(data[PACKET_SIZE:], 'big')
+
+
+class RecentIds:
+    """Кольцо последних id команд: повтор команды подтверждается, но не выполняется"""
+
+    def __init__(self, size: int = RECENT_COMMANDS):
+        self._order = collections.deque(maxlen=size)
+        self._ids = set()
+
+    def __contains__(self, cmd_id):
+        return cmd_id in self._ids
 
-    # Бесконечный цикл прослушивания
-    while True:
-        # Получаем данные из сокета
-        data, _ = server_socket.recvfrom(1024)
+    def add(self, cmd_id):
+        if len(self._order) == self._order.maxlen:
+            self._ids.discard(self._order[0])
+        self._order.append(cmd_id)
+        self._ids.add(cmd_id)
 
-        # Проверяем, является ли пакет WoL пакетом
-        is_wol_packet = check_is_wol_packet(data, assembled_off_packet)
-        is_sleep_packet = check_is_wol_packet(data, assembled_sleep_packet)
-        # Если это WoL пакет - выключаем компьютер или засыпаем
-        if is_sleep_packet == 1:
-            if os.name == 'posix':  # Linux/Unix системы
-                os.system('sudo systemctl suspend')
-            elif os.name == 'nt':   # Windows системы
-                os.system('rundll32.exe powrprof.dll,SetSuspendState 0,1,0')
-        elif is_wol_packet == 1:
-            if os.name == 'posix':  # Linux/Unix системы
-                os.system('sudo shutdown -h now')
-            elif os.name == 'nt':   # Windows системы
-                os.system('shutdown -s -t 0 -f')
+# Команды питания по ОС; запускаются напрямую, без оболочки
+POWER_COMMANDS = {
+    'posix': {  # Linux/Unix системы
+        COMMAND_OFF: ['sudo', 'shutdown', '-h', 'now'],
+        COMMAND_SLEEP: ['sudo', 'systemctl', 'suspend'],
+    },
+    'nt': {     # Windows системы
+        COMMAND_OFF: ['shutdown', '-s', '-t', '0', '-f'],
+        COMMAND_SLEEP: ['rundll32.exe', 'powrprof.dll,SetSuspendState', '0,1,0'],
+    },
+}
 
 
+def run_power_command(command: str):
+    """
+    Выключает компьютер или переводит его в сон
+
+    Args:
+        command (str): COMMAND_OFF или COMMAND_SLEEP
+    """
+    argv = POWER_COMMANDS.get(os.name, {}).get(command)
+    if argv is None:
+        logger.error(f"Команда {command} не поддерживается на {os.name}")
+        return
+    logger.info(f"Выполняется команда питания: {' '.join(argv)}")
+    global power_process
+    try:
+        import subprocess
+        # Без stdin: sudo, которому нужен пароль, сразу завершится с ошибкой
+        power_process = subprocess.Popen(argv, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        logger.error(f"Не удалось выполнить команду питания: {e}")
+        resume_heartbeats()
+
+
+def check_power_command():
+    """
+    Проверяет завершившуюся команду питания. Если она завершилась с ошибкой,
+    ПК не выключится и не уснет, поэтому heartbeat'ы возобновляются сразу
+    """
+    global power_process
+    if power_process is None or power_process.poll() is None:
+        return
+    process, power_process = power_process, None
+    with process.stderr:
+        if process.returncode != 0:
+            error = process.stderr.read().decode(errors='replace').strip()
+            logger.error(f"Команда питания {' '.join(process.args)} завершилась с кодом "
+                         f"{process.returncode}: {error}")
+            resume_heartbeats()
+
+
+def get_boot_time(refresh: bool = False) -> float:
+    """
+    Возвращает время загрузки системы (кэшируется; обновляется после выхода из сна)
+
+    Args:
+        refresh (bool): Перечитать время загрузки у системы
+
+    Returns:
+        float: Время загрузки системы (unix time)
+    """
+    global _boot_time
+    if _boot_time is None or refresh:
+        _boot_time = None
+        if sys.platform.startswith('linux'):
+            # То же значение, что отдает psutil, но без его импорта
+            try:
+                with open('/proc/stat', 'rb') as f:
+                    for line in f:
+                        if line.startswith(b'btime '):
+                            _boot_time = float(line.split()[1])
+                            break
+            except OSError:
+                pass
+        if _boot_time is None:
+            import psutil
+            _boot_time = psutil.boot_time()
+    return _boot_time
+
 
 def get_system_uptime() -> dict:
     """
@@ -132,7 +323,7 @@ def get_system_uptime() -> dict:
         dict: Словарь с временем работы системы
     """
     # Получаем время загрузки системы
-    boot_time = psutil.boot_time()
+    boot_time = get_boot_time()
     current_time = time.time()
     uptime_seconds = current_time - boot_time
     
@@ -149,72 +340,231 @@ def get_system_uptime() -> dict:
         'formatted_uptime': f"{int(uptime_days)}d {int(uptime_hours % 24)}h {int((uptime_seconds % 3600) / 60)}m {int(uptime_seconds % 60)}s"
     }
 
-def send_time_to_server(mac_address: str, broadcast_ip: str = "192.168.50.255", port: int = TIME_PORT):
+def build_time_message(mac_address: str, kind: int = KIND_HEARTBEAT) -> bytes:
+    """
+    Собирает пакет для бота в формате HEARTBEAT_FORMAT
+
+    Args:
+        mac_address (str): MAC-адрес этого ПК
+        kind (int): KIND_HEARTBEAT, KIND_SHUTDOWN или KIND_SLEEP
+
+    Returns:
+        bytes: Пакет для отправки
+    """
+    if HEARTBEAT_FORMAT == 'json':
+        # Получаем время работы системы
+        uptime_data = get_system_uptime()
+
+        # Добавляем MAC-адрес этого ПК (старый агент клал сюда MAC сервера) и
+        # номер пакета: по seq новый бот отличает такой пакет от пакета старого агента
+        uptime_data['sender_mac'] = mac_address
+        uptime_data['seq'] = next(heartbeat_seq)
+        if kind == KIND_SHUTDOWN:
+            uptime_data['event'] = 'shutdown'
+        elif kind == KIND_SLEEP:
+            uptime_data['event'] = 'sleep'
+
+        # Конвертируем в JSON
+        import json
+        return json.dumps(uptime_data, ensure_ascii=False).encode('utf-8')
+
+    # Бинарный формат: бот сам считает время работы по времени загрузки
+    return encode_heartbeat(mac_to_bytes(mac_address), get_boot_time(), next(heartbeat_seq), kind)
+
+def open_listen_socket(ip_addr: str, port: int) -> socket.socket:
+    """Неблокирующий сокет для командных пакетов на адресе интерфейса"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind((ip_addr, port))
+    except OSError:
+        sock.close()
+        raise
+    sock.setblocking(False)
+    logger.info(f'Listening on {ip_addr}:{port}')
+    return sock
+
+def open_broadcast_socket() -> socket.socket:
+    """Создает UDP сокет для broadcast-отправки"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    return sock
+
+def send_time_to_server(mac_address: str, broadcast_ip: str = "192.168.50.255", port: int = TIME_PORT,
+                        sock: socket.socket = None):
     """
     Отправляет время работы системы на сервер
     
     Args:
-        mac_address (str): MAC-адрес сервера
+        mac_address (str): MAC-адрес этого ПК (по нему бот различает машины)
         broadcast_ip (str): Broadcast IP адрес
         port (int): Порт для отправки
+        sock (socket.socket): Постоянный broadcast-сокет (по умолчанию - временный)
     """
     try:
-        # Получаем время работы системы
-        uptime_data = get_system_uptime()
-        
-        # Добавляем MAC-адрес отправителя
-        uptime_data['sender_mac'] = mac_address
-        
-        # Конвертируем в JSON
-        time_message = json.dumps(uptime_data, ensure_ascii=False)
+        time_message = build_time_message(mac_address)
         
         # Отправка UDP broadcast
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(time_message.encode('utf-8'), (broadcast_ip, port))
+        if sock is None:
+            with open_broadcast_socket() as temp_sock:
+                temp_sock.sendto(time_message, (broadcast_ip, port))
+        else:
+            sock.sendto(time_message, (broadcast_ip, port))
             
-        logger.info(f"Отправлено время работы системы: {uptime_data['formatted_uptime']} по адресу {broadcast_ip}:{port} с MAC-адресом {mac_address}")
+        logger.debug(f"Отправлен heartbeat ({HEARTBEAT_FORMAT}, {len(time_message)} байт) по адресу {broadcast_ip}:{port} с MAC-адресом {mac_address}")
         
     except Exception as e:
         logger.error(f"Ошибка при отправке времени: {e}")
 
-def send_uptime_command():
+def announce_power_state(mac_address: str, command: str, sock: socket.socket = None):
     """
-    Команда для отправки времени работы системы
+    Сообщает боту, что ПК выключается или засыпает, и останавливает heartbeat'ы
+
+    Уведомление отправляется несколько раз подряд на случай потери пакета.
+
+    Args:
+        mac_address (str): MAC-адрес этого ПК
+        command (str): COMMAND_OFF или COMMAND_SLEEP
+        sock (socket.socket): Постоянный broadcast-сокет (по умолчанию - временный)
     """
-    if not SERVER_MAC_ADDRESS or not BROADCAST_IP:
-        logger.error("Не установлены переменные окружения SERVER_MAC_ADDRESS или BROADCAST_IP")
+    global heartbeat_paused_until
+    if command == COMMAND_OFF:
+        kind = KIND_SHUTDOWN
+        heartbeat_paused_until = time.monotonic() + OFF_HEARTBEAT_PAUSE
+    else:
+        kind = KIND_SLEEP
+        heartbeat_paused_until = time.monotonic() + SLEEP_HEARTBEAT_PAUSE
+
+    if not BROADCAST_IP:
         return
-    
-    send_time_to_server(SERVER_MAC_ADDRESS, BROADCAST_IP, TIME_PORT)
+    try:
+        message = build_time_message(mac_address, kind)
+        send_sock = sock if sock is not None else open_broadcast_socket()
+        try:
+            for copy in range(POWER_NOTICE_COPIES):
+                if copy:
+                    time.sleep(POWER_NOTICE_GAP)
+                send_sock.sendto(message, (BROADCAST_IP, TIME_PORT))
+        finally:
+            if sock is None:
+                send_sock.close()
+        logger.info(f"Отправлено уведомление: {command}")
+    except OSError as e:
+        logger.error(f"Ошибка при отправке уведомления {command}: {e}")
+
+def resume_heartbeats():
+    """Снимает паузу heartbeat'ов (после сна или неудачной команды питания)"""
+    global heartbeat_paused_until
+    heartbeat_paused_until = 0.0
 
-def send_uptime_periodically(interval_seconds: int = 5):
+def run_agent(interface_name: str, port: int = WOL_PORT):
     """
-    Периодически отправляет время работы системы
+    Основной цикл агента в одном потоке: один selector ждет командные пакеты
+    на постоянном сокете, а таймаут select() отсчитывает следующий heartbeat
+    по расписанию HeartbeatScheduler. Heartbeat'ы уходят через постоянный
+    broadcast-сокет. Если адрес интерфейса меняется (DHCP, переподключение),
+    сокет команд пересоздается на новом адресе.
     
     Args:
-        interval_seconds (int): Интервал отправки в секундах
+        interface_name (str): Имя сетевого интерфейса
+        port (int): UDP порт для командных пакетов
     """
-    while True:
-        try:
-            send_uptime_command()
-            time.sleep(interval_seconds)
-        except Exception as e:
-            logger.error(f"Ошибка в периодической отправке времени: {e}")
-            time.sleep(interval_seconds)
+    # Получаем IP и MAC адрес интерфейса; MAC - идентификатор этого ПК в реестре бота
+    resolver = InterfaceResolver(interface_name, INTERFACE_ADDRESS)
+    ip_addr, mac_addr = resolver.resolve()
+
+    # Постоянные сокеты: прием команд и отправка heartbeat'ов
+    listen_sock = open_listen_socket(ip_addr, port)
+    send_sock = open_broadcast_socket()
+
+    # Собираем ожидаемые пакеты один раз
+    packet_table = build_packet_table(mac_addr)
+
+    recent_commands = RecentIds()
+
+    def handle_packet(view: memoryview, addr) -> bool:
+        # Определяем команду прямо по буферу; чужие пакеты отсекаются по длине сразу
+        command = classify_packet(view, packet_table)
+        if command is None:
+            return False
+        cmd_id = command_id(view)
+        if cmd_id is not None:
+            # Подтверждаем до выполнения: после выключения ответить будет некому.
+            # Повтор подтверждается снова (прошлое подтверждение могло потеряться)
+            try:
+                listen_sock.sendto(encode_heartbeat(mac_to_bytes(mac_addr), get_boot_time(), cmd_id, KIND_ACK), addr)
+            except OSError as e:
+                logger.error(f"Не удалось подтвердить команду {cmd_id}: {e}")
+            if cmd_id in recent_commands:
+                logger.info(f"Повтор команды {command} ({cmd_id}) от {addr[0]} пропущен")
+                return True
+            recent_commands.add(cmd_id)
+        # Сначала сообщаем боту, потом выключаем компьютер или засыпаем
+        announce_power_state(mac_addr, command, send_sock)
+        run_power_command(command)
+        return True
+
+    receiver = DatagramReceiver(max_size=1024)
+    scheduler = HeartbeatScheduler(HEARTBEAT_INTERVAL, HEARTBEAT_FAST_INTERVAL, HEARTBEAT_FAST_PERIOD)
+    selector = selectors.DefaultSelector()
+    selector.register(listen_sock, selectors.EVENT_READ)
+    if resolver.watch_socket is not None:
+        selector.register(resolver.watch_socket, selectors.EVENT_READ)
+    if not BROADCAST_IP:
+        logger.error("Не установлена переменная окружения BROADCAST_IP, heartbeat'ы не отправляются")
+
+    try:
+        while True:
+            check_power_command()
+            if scheduler.check_resume():
+                logger.info("Обнаружен выход из сна, heartbeat отправляется сразу")
+                resume_heartbeats()
+                get_boot_time(refresh=True)
+            if scheduler.due():
+                # Пока ПК выключается или засыпает, бот уже уведомлен
+                if BROADCAST_IP and time.monotonic() >= heartbeat_paused_until:
+                    send_time_to_server(mac_addr, BROADCAST_IP, TIME_PORT, send_sock)
+                scheduler.sent()
+
+            # Ждем командный пакет не дольше, чем до следующего события расписания
+            for key, _ in selector.select(scheduler.sleep_time()):
+                if key.fileobj is not listen_sock:
+                    continue
+                try:
+                    receiver.drain(listen_sock, handle_packet)
+                except OSError as e:
+                    logger.error(f"Ошибка приема командного пакета: {e}")
+
+            # Адрес интерфейса изменился - переносим сокет команд на новый адрес
+            if resolver.poll():
+                new_ip, new_mac = resolver.resolve()
+                if new_mac != mac_addr:
+                    mac_addr = new_mac
+                    packet_table = build_packet_table(mac_addr)
+                if new_ip != ip_addr:
+                    try:
+                        new_sock = open_listen_socket(new_ip, port)
+                    except OSError as e:
+                        logger.error(f"Не удалось открыть сокет на {new_ip}:{port}: {e}")
+                    else:
+                        selector.unregister(listen_sock)
+                        listen_sock.close()
+                        listen_sock, ip_addr = new_sock, new_ip
+                        selector.register(listen_sock, selectors.EVENT_READ)
+                # Сообщаем боту новый адрес сразу
+                scheduler.restart()
+    finally:
+        logger.info(f'Счетчики приема: {receiver.stats()}, '
+                    f'адрес перечитан {resolver.refreshes} раз, изменений {resolver.changes}')
+        selector.close()
+        listen_sock.close()
+        send_sock.close()
+        resolver.close()
 
 def main():
-    # Запускаем отправку времени в отдельном потоке
-    time_thread = threading.Thread(target=send_uptime_periodically, daemon=True)
-    time_thread.start()
-    
-    # Запускаем основной цикл прослушивания WoL пакетов
-    run_udp_port_listener_lan(WOL_PORT, INTERFACE_NAME)
+    run_agent(INTERFACE_NAME, WOL_PORT)
 
 # Запуск основного цикла прослушивания
 if __name__ == '__main__':
-    print(SERVER_MAC_ADDRESS, BROADCAST_IP)
+    print(INTERFACE_NAME, BROADCAST_IP)
 
     main()
-
-
@@ -0,0 +1,127 @@
+# Постоянное хранилище сессий пользователей: какое сообщение со статусом править
+
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Сообщение со статусом, которое бот правит у пользователя
+Session = namedtuple('Session', 'chat_id message_id')
+
+
+class SessionStore(SQLiteStore):
+    """
+    Сессии пользователей в памяти с периодической записью в SQLite (WAL).
+
+    Изменения копятся в памяти и записываются одной транзакцией раз в
+    flush_interval секунд в отдельном потоке, поэтому запись на диск не
+    блокирует цикл событий. Для каждого пользователя хранится только пара
+    (chat_id, message_id).
+    """
+
+    subject = 'сессий'
+
+    def __init__(self, path: str = 'sessions.db', flush_interval: float = 2.0):
+        super().__init__(path, flush_interval)
+        self._sessions = {}
+        self._dirty = set()
+        self._wakeup = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    def items(self):
+        # Копия: рассылка может менять сессии, пока идет перебор
+        return list(self._sessions.items())
+
+    def get(self, user_id: int) -> Session:
+        return self._sessions.get(user_id)
+
+    def set(self, user_id: int, chat_id: int, message_id: int):
+        """Запоминает сообщение со статусом пользователя"""
+        session = Session(chat_id, message_id)
+        if self._sessions.get(user_id) == session:
+            return
+        self._sessions[user_id] = session
+        self._mark(user_id)
+
+    def remove(self, user_id: int):
+        """Удаляет сессию (чат удален, бот заблокирован)"""
+        if self._sessions.pop(user_id, None) is not None:
+            self._mark(user_id)
+
+    def _mark(self, user_id: int):
+        self._dirty.add(user_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'user_id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, '
+            'message_id INTEGER NOT NULL, updated REAL NOT NULL)'
+        )
+
+    def _load(self) -> dict:
+        rows = self._connect().execute('SELECT user_id, chat_id, message_id FROM sessions').fetchall()
+        return {user_id: Session(chat_id, message_id) for user_id, chat_id, message_id in rows}
+
+    async def load(self):
+        """
+        Читает сохраненные сессии (вызывается при запуске бота). Сессии,
+        созданные до окончания чтения, имеют приоритет над сохраненными
+        """
+        loaded = await asyncio.get_running_loop().run_in_executor(None, self._load)
+        for user_id, session in loaded.items():
+            self._sessions.setdefault(user_id, session)
+        self.loaded = True
+        logger.info(f"Загружено сессий: {len(loaded)}")
+
+    def _write(self, changes: list):
+        now = time.time()
+        upserts = [(user_id, s.chat_id, s.message_id, now) for user_id, s in changes if s is not None]
+        deletes = [(user_id,) for user_id, s in changes if s is None]
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                'INSERT INTO sessions (user_id, chat_id, message_id, updated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET chat_id=excluded.chat_id, '
+                'message_id=excluded.message_id, updated=excluded.updated',
+                upserts,
+            )
+            connection.executemany('DELETE FROM sessions WHERE user_id = ?', deletes)
+
+    def _take_changes(self):
+        if not self._dirty:
+            return None
+        changes = [(user_id, self._sessions.get(user_id)) for user_id in self._dirty]
+        self._dirty.clear()
+        return (changes,)
+
+    def _restore(self, changes: list):
+        # Повторим в следующий раз, если сессию не успели изменить снова
+        self._dirty.update(user_id for user_id, _ in changes)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        changes = self._take_changes()
+        if changes is not None:
+            await self._write_async(*changes)
+
+    async def _flush_loop(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Копим изменения flush_interval секунд и пишем их разом
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,324 @@
+# Нагрузочный стенд: N симулированных агентов, заглушка Telegram Bot API и настоящий бот
+#
+# Все работает на loopback и без сети, подходит для CI:
+#   python simulate_fleet.py --agents 200 --users 20 --interval 1 --duration 30 \
+#       --api-latency 0.05 --rate-limit 0.01 --churn 0.2
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import time
+import urllib.parse
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOKEN = '123456:SIMULATED'
+
+
+class FakeBotApi:
+    """
+    Заглушка Telegram Bot API поверх asyncio.start_server.
+
+    Отвечает на методы, которые вызывает бот, записывает каждый вызов
+    (время, метод, чат, текст) и умеет добавлять задержку и ответы 429.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.calls = []
+        self.methods = Counter()
+        self.limited = 0
+        self.server = None
+        self.port = None
+        self._message_ids = iter(range(1000, 1 << 31))
+
+    async def start(self, host: str = '127.0.0.1'):
+        self.server = await asyncio.start_server(self._serve, host, 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/bot'
+
+    def close(self):
+        self.server.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+
+                method = request_line.split()[1].decode().rsplit('/', 1)[-1]
+                params = self._parse(body, headers.get('content-type', ''))
+                response = await self._call(method, params)
+                status = response.get('error_code', 200)
+                data = json.dumps(response).encode()
+                writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                             f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode()
+                             + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(body: bytes, content_type: str) -> dict:
+        if 'json' in content_type:
+            return json.loads(body or b'{}')
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+    async def _call(self, method: str, params: dict) -> dict:
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if method in ('sendMessage', 'editMessageText') and random.random() < self.rate_limit:
+            self.limited += 1
+            return {'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after}}
+
+        self.methods[method] += 1
+        chat_id = int(params.get('chat_id', 0) or 0)
+        self.calls.append((time.monotonic(), method, chat_id, params.get('text', '')))
+
+        if method == 'getMe':
+            return {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'sim', 'username': 'sim_bot'}}
+        if method in ('sendMessage', 'editMessageText'):
+            message_id = int(params.get('message_id') or next(self._message_ids))
+            return {'ok': True, 'result': {
+                'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', ''),
+            }}
+        return {'ok': True, 'result': True}
+
+
+class SimulatedAgent:
+    """Агент ПК: heartbeat'ы в формате pc.py, выключение с уведомлением и повторное включение"""
+
+    def __init__(self, index: int, bot_port: int, interval: float):
+        from heartbeat import encode_heartbeat
+
+        self.encode = encode_heartbeat
+        self.mac_bytes = bytes([0x02, 0x51, 0x4D]) + index.to_bytes(3, 'big')
+        self.mac = self.mac_bytes.hex('-').upper()
+        self.addr = ('127.0.0.1', bot_port)
+        self.interval = interval
+        self.boot_time = time.time() - random.uniform(60, 86400)
+        self.seq = 0
+        self.sent = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        # (момент, ожидаемый статус) - для задержки смены статуса
+        self.transitions = []
+
+    def send(self, kind: int):
+        self.seq += 1
+        try:
+            self.sock.sendto(self.encode(self.mac_bytes, self.boot_time, self.seq, kind), self.addr)
+            self.sent += 1
+        except BlockingIOError:
+            pass
+
+    async def run(self, until: float, power_cycle_at: float = None, off_time: float = 5.0):
+        from heartbeat import KIND_HEARTBEAT, KIND_SHUTDOWN
+        from fleet import STATUS_ON, STATUS_OFF
+
+        loop = asyncio.get_running_loop()
+        # Случайная фаза, чтобы агенты не слали heartbeat'ы одновременно
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while loop.time() < until:
+            if power_cycle_at is not None and loop.time() >= power_cycle_at:
+                power_cycle_at = None
+                # Как pc.announce_power_state: несколько копий уведомления
+                self.transitions.append((time.monotonic(), STATUS_OFF))
+                for _ in range(3):
+                    self.send(KIND_SHUTDOWN)
+                await asyncio.sleep(off_time)
+                self.boot_time = time.time()
+                self.transitions.append((time.monotonic(), STATUS_ON))
+            self.send(KIND_HEARTBEAT)
+            await asyncio.sleep(self.interval)
+        self.sock.close()
+
+
+def status_latencies(agents, calls) -> list:
+    """Для каждого перехода агента: через сколько секунд новый статус появился в Telegram"""
+    latencies = []
+    for agent in agents:
+        for started, status in agent.transitions:
+            needle = f'{agent.mac}\nstatus: {status}'
+            for at, method, _, text in calls:
+                if at >= started and needle in text:
+                    latencies.append(at - started)
+                    break
+    return latencies
+
+
+def describe(values, unit: float = 1000.0, suffix: str = 'мс') -> str:
+    if not values:
+        return 'нет данных'
+    values = sorted(values)
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+    return (f'n={len(values)} p50={statistics.median(values) * unit:.1f} '
+            f'p99={p99 * unit:.1f} max={values[-1] * unit:.1f} {suffix}')
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def simulate(args) -> dict:
+    import logging
+    import warnings
+    import bot
+
+    warnings.filterwarnings('ignore', message='Tasks created via `Application.create_task`')
+
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    api = FakeBotApi(args.api_latency, args.rate_limit, args.retry_after)
+    await api.start()
+    application = bot.build_application(FAKE_TOKEN, api.base_url, with_updater=False)
+    # Тот же порядок, что и в run_polling, только без getUpdates: фоновые задачи
+    # post_init не ждутся при остановке Application
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+
+    # Активные пользователи, которым рассылается статус
+    for user_id in range(1, args.users + 1):
+        bot.sessions.set(user_id, user_id, 1)
+
+    loop = asyncio.get_running_loop()
+    agents = [SimulatedAgent(index, bot.PORT, args.interval) for index in range(args.agents)]
+    started = loop.time()
+    until = started + args.duration
+    tasks = []
+    for agent in agents:
+        power_cycle_at = None
+        if random.random() < args.churn:
+            power_cycle_at = started + random.uniform(0.3, 0.6) * args.duration
+        tasks.append(asyncio.create_task(agent.run(until, power_cycle_at, args.off_time)))
+    await asyncio.gather(*tasks)
+    # Даем рассылке догнать последние изменения
+    await asyncio.sleep(args.settle)
+    elapsed = loop.time() - started
+
+    heartbeats = sum(value for name, _, value in bot.bot_metrics.counters() if name == 'heartbeats')
+    processing = bot.bot_metrics.histogram('task_seconds', {'task': 'heartbeat'}).summary()
+    lag = bot.loop_lag.summary()
+    receiver = bot.heartbeat_listener.receiver.stats()
+    latencies = status_latencies(agents, api.calls)
+    transitions = sum(len(agent.transitions) for agent in agents)
+    result = {
+        'agents': args.agents,
+        'users': args.users,
+        'elapsed': elapsed,
+        'heartbeats_sent': sum(agent.sent for agent in agents),
+        'heartbeats_processed': heartbeats,
+        'heartbeats_per_second': heartbeats / elapsed,
+        'receiver': receiver,
+        'heartbeat_processing': processing,
+        'status_transitions': transitions,
+        'status_latencies_seen': len(latencies),
+        'status_latency': describe(latencies),
+        'api_calls': dict(api.methods),
+        'api_calls_per_second': sum(api.methods.values()) / elapsed,
+        'api_rate_limited': api.limited,
+        'dispatcher': {'sent': bot.notifier.sent, 'collapsed': bot.notifier.collapsed,
+                       'failed': bot.notifier.failed},
+        'render_skipped': bot.render_cache.skipped,
+        'loop_lag': lag,
+    }
+
+    await application.stop()
+    await bot.post_stop(application)
+    await bot.post_shutdown(application)
+    await application.shutdown()
+    api.close()
+    return result
+
+
+def print_report(result: dict):
+    ms = lambda value: f'{value * 1000:.2f} мс' if value is not None else '-'
+    processing = result['heartbeat_processing']
+    lag = result['loop_lag']
+    print(f"Агентов: {result['agents']}, пользователей: {result['users']}, {result['elapsed']:.1f} с")
+    print(f"Heartbeat'ы: отправлено {result['heartbeats_sent']}, обработано {result['heartbeats_processed']} "
+          f"({result['heartbeats_per_second']:.0f}/с), прием: {result['receiver']}")
+    print(f"Обработка heartbeat'а: p50 {ms(processing['p50'])}, p99 {ms(processing['p99'])}, "
+          f"max {ms(processing['max'])}")
+    print(f"Смена статуса до Telegram: {result['status_latency']} "
+          f"(увидено {result['status_latencies_seen']} из {result['status_transitions']})")
+    print(f"Вызовы Bot API: {result['api_calls']} ({result['api_calls_per_second']:.1f}/с), "
+          f"429: {result['api_rate_limited']}")
+    print(f"Диспетчер: {result['dispatcher']}, правок без изменений пропущено: {result['render_skipped']}")
+    print(f"Задержка цикла событий: p50 {ms(lag['p50'])}, p99 {ms(lag['p99'])}, max {ms(lag['max'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Симуляция парка ПК и Telegram для нагрузочного теста бота')
+    parser.add_argument('--agents', type=int, default=50, help='Сколько ПК симулировать')
+    parser.add_argument('--users', type=int, default=5, help='Сколько пользователей получают статус')
+    parser.add_argument('--interval', type=float, default=1.0, help='Интервал heartbeat\'ов агента, с')
+    parser.add_argument('--duration', type=float, default=20.0, help='Длительность симуляции, с')
+    parser.add_argument('--settle', type=float, default=2.0, help='Сколько ждать рассылку после остановки агентов, с')
+    parser.add_argument('--churn', type=float, default=0.2, help='Доля ПК, которые выключаются и включаются')
+    parser.add_argument('--off-time', type=float, default=3.0, help='Сколько ПК остается выключенным, с')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='Средняя задержка ответа Bot API, с')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Доля запросов, получающих 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, с')
+    parser.add_argument('--seed', type=int, help='Зерно генератора для повторяемости')
+    parser.add_argument('--json', help='Сохранить результаты в JSON-файл')
+    parser.add_argument('--verbose', action='store_true', help='Показывать логи бота')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # Окружение бота задается до его импорта: без сети, без файлов
+    os.environ.update({
+        'PORT': str(free_udp_port()),
+        'TELEGRAM_BOT_TOKEN': FAKE_TOKEN,
+        'USERS': '[' + ','.join(str(user_id) for user_id in range(1, args.users + 1)) + ']',
+        'LOG_FILE': '',
+        'SESSION_DB': ':memory:',
+        'HISTORY_DB': ':memory:',
+        'METRICS_PORT': '0',
+        'BOT_MODE': 'polling',
+        'MAX_PCS': str(args.agents),
+    })
+    os.environ.pop('PC_MAC_ADDRESS', None)
+    os.environ.pop('PC_MAC_ADDRESSES', None)
+    sys.path.insert(0, HERE)
+
+    from udp_io import use_selector_event_loop
+    use_selector_event_loop()
+    result = asyncio.run(simulate(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Общий жизненный цикл хранилищ с пакетной записью в SQLite
+
+import asyncio
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """
+    Основа хранилищ, которые копят изменения в памяти и записывают их в
+    SQLite (WAL) одной транзакцией в потоке исполнителя.
+
+    Подкласс задает схему (_create_tables), набор изменений (_take_changes
+    возвращает аргументы для _write или None, если записывать нечего),
+    саму запись (_write) и возврат изменений после неудачной записи
+    (_restore), а также цикл записи _flush_loop. Соединение используется
+    потоками исполнителя, но всегда только одним сразу: close() сначала
+    останавливает цикл записи и дожидается идущей транзакции.
+    """
+
+    # Чего касается хранилище - для сообщений об ошибках ("Ошибка записи сессий")
+    subject = 'данных'
+
+    def __init__(self, path: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._connection = None
+        # Задача цикла записи и запись, которая идет в потоке исполнителя
+        self._runner = None
+        self._flushing = None
+        self.writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._create_tables(self._connection)
+        return self._connection
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        raise NotImplementedError
+
+    def _take_changes(self):
+        raise NotImplementedError
+
+    def _write(self, *changes):
+        raise NotImplementedError
+
+    def _restore(self, *changes):
+        raise NotImplementedError
+
+    async def _flush_loop(self):
+        raise NotImplementedError
+
+    async def _write_async(self, *changes) -> bool:
+        """
+        Записывает изменения в потоке исполнителя
+
+        Returns:
+            bool: True, если запись удалась; иначе изменения возвращены через _restore
+        """
+        self._flushing = asyncio.get_running_loop().run_in_executor(None, self._write, *changes)
+        try:
+            # При отмене цикла записи транзакция все равно доводится до конца,
+            # и close() ее дожидается
+            await asyncio.shield(self._flushing)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи {self.subject}: {e}")
+            self._restore(*changes)
+            return False
+        self.writes += 1
+        return True
+
+    async def run(self):
+        """Цикл пакетной записи, запускается отдельной задачей"""
+        self._runner = asyncio.current_task()
+        await self._flush_loop()
+
+    async def close(self):
+        """
+        Останавливает цикл записи, дожидается идущей записи, затем
+        записывает оставшиеся изменения и закрывает базу
+        """
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._flushing is not None:
+            try:
+                await self._flushing
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи {self.subject}: {e}")
+            self._flushing = None
+        changes = self._take_changes()
+        try:
+            if changes is not None:
+                self._write(*changes)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи {self.subject} при остановке: {e}")
+        finally:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,120 @@
+# Общий цикл приема UDP-датаграмм в заранее выделенный буфер
+
+import asyncio
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# WSAEMSGSIZE: на Windows слишком длинная датаграмма приходит как ошибка
+_WSAEMSGSIZE = 10040
+
+# Сколько датаграмм принимать за одно пробуждение: при потоке пакетов
+# цикл не должен застревать в приеме, остаток заберем на следующем проходе
+DRAIN_LIMIT = 64
+
+
+def use_selector_event_loop():
+    """
+    Включает SelectorEventLoop на Windows: в ProactorEventLoop по умолчанию
+    нет loop.add_reader, на котором построены слушатель heartbeat'ов и
+    прием подтверждений команд. Вызывается до создания цикла событий
+    """
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+class DatagramReceiver:
+    """
+    Прием датаграмм через recvfrom_into в один bytearray.
+
+    handler(view, addr) получает memoryview на принятые байты. View
+    действителен только до следующего приема, поэтому если пакет нужно
+    сохранить, handler сам делает копию. handler возвращает True, если
+    пакет принят, и False, если отброшен (чужой, битый, очередь полна).
+
+    Буфер на байт длиннее max_size: по этому лишнему байту видно, что
+    датаграмма не поместилась и была обрезана.
+    """
+
+    __slots__ = ('max_size', '_buffer', '_view', 'received', 'kept', 'dropped', 'oversize')
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._buffer = bytearray(max_size + 1)
+        self._view = memoryview(self._buffer)
+        self.received = 0
+        self.kept = 0
+        self.dropped = 0
+        self.oversize = 0
+
+    def receive(self, sock, handler) -> bool:
+        """
+        Принимает одну датаграмму и передает ее в handler
+
+        Args:
+            sock (socket.socket): UDP сокет
+            handler: Функция handler(view, addr) -> bool
+
+        Returns:
+            bool: True, если handler принял пакет
+
+        Raises:
+            BlockingIOError: Если сокет неблокирующий и данных нет
+        """
+        try:
+            nbytes, addr = sock.recvfrom_into(self._buffer)
+        except OSError as e:
+            if getattr(e, 'winerror', None) != _WSAEMSGSIZE:
+                raise
+            self.received += 1
+            self.oversize += 1
+            return False
+
+        self.received += 1
+        if nbytes > self.max_size:
+            self.oversize += 1
+            return False
+        if handler(self._view[:nbytes], addr):
+            self.kept += 1
+            return True
+        self.dropped += 1
+        return False
+
+    def drain(self, sock, handler, limit: int = DRAIN_LIMIT) -> int:
+        """
+        Принимает датаграммы, уже ожидающие в неблокирующем сокете, но не больше limit
+
+        Селектор и add_reader срабатывают по уровню, поэтому оставшиеся
+        в сокете датаграммы разбудят цикл снова, уже после других событий
+
+        Args:
+            sock (socket.socket): Неблокирующий UDP сокет
+            handler: Функция handler(view, addr) -> bool
+            limit (int): Наибольшее число датаграмм за вызов
+
+        Returns:
+            int: Количество принятых датаграмм
+        """
+        count = 0
+        while count < limit:
+            try:
+                self.receive(sock, handler)
+            except (BlockingIOError, InterruptedError):
+                break
+            count += 1
+        return count
+
+    def serve_forever(self, sock, handler):
+        """Блокирующий цикл приема для обычного сокета"""
+        while True:
+            self.receive(sock, handler)
+
+    def stats(self) -> dict:
+        """Счетчики приема: всего, принято, отброшено, слишком длинных"""
+        return {
+            'received': self.received,
+            'kept': self.kept,
+            'dropped': self.dropped,
+            'oversize': self.oversize,
+        }
@@ -0,0 +1,95 @@
+# Отслеживание включения ПК: сколько проходит от команды WOL до первого heartbeat'а
+
+import asyncio
+
+from metrics import Histogram, BOOT_BUCKETS
+
+
+class WakeTracker:
+    """
+    Ожидание первого heartbeat'а после команды включения.
+
+    arm() запоминает момент отправки WOL и создает future, который
+    on_heartbeat() завершает задержкой включения в секундах. Задержки
+    пишутся в гистограммы - общую и по каждому ПК. Время - монотонные
+    часы event loop.
+    """
+
+    def __init__(self, buckets=BOOT_BUCKETS):
+        self._buckets = buckets
+        self._pending = {}
+        self.histograms = {}
+        self.overall = Histogram(buckets)
+
+    def __contains__(self, mac):
+        return mac in self._pending
+
+    def arm(self, mac: str) -> asyncio.Future:
+        """
+        Отмечает отправку команды включения ПК
+
+        Повторное нажатие, пока ПК еще не включился, не сбрасывает
+        время отсчета - задержка считается от первой команды.
+
+        Args:
+            mac (str): Нормализованный MAC-адрес ПК
+
+        Returns:
+            asyncio.Future: Завершится задержкой включения в секундах
+        """
+        pending = self._pending.get(mac)
+        if pending is not None:
+            return pending[1]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[mac] = (loop.time(), future)
+        return future
+
+    def on_heartbeat(self, mac: str, now: float = None):
+        """
+        Обрабатывает heartbeat от ПК
+
+        Args:
+            mac (str): Нормализованный MAC-адрес ПК
+            now (float): Время получения по часам loop.time()
+
+        Returns:
+            float | None: Задержка включения, если ПК ждали
+        """
+        pending = self._pending.pop(mac, None)
+        if pending is None:
+            return None
+        sent_at, future = pending
+        if now is None:
+            now = asyncio.get_running_loop().time()
+        latency = now - sent_at
+
+        histogram = self.histograms.get(mac)
+        if histogram is None:
+            histogram = self.histograms[mac] = Histogram(self._buckets)
+        histogram.observe(latency)
+        self.overall.observe(latency)
+
+        if not future.done():
+            future.set_result(latency)
+        return latency
+
+    async def wait_until_up(self, mac: str, timeout: float):
+        """
+        Ждет первого heartbeat'а ПК после команды включения
+
+        Args:
+            mac (str): Нормализованный MAC-адрес ПК
+            timeout (float): Сколько секунд ждать
+
+        Returns:
+            float | None: Задержка включения в секундах или None по таймауту
+        """
+        future = self.arm(mac)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pending = self._pending.get(mac)
+            if pending is not None and pending[1] is future:
+                del self._pending[mac]
+            return None
@@ -0,0 +1,142 @@
+# Прием обновлений Telegram через webhook: минимальный HTTP(S)-сервер на asyncio
+
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+_RESPONSES = {
+    200: b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n',
+    400: b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    403: b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    404: b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    405: b'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    408: b'HTTP/1.1 408 Request Timeout\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    413: b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+    431: b'HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n',
+}
+
+
+class WebhookServer:
+    """
+    Сервер, который принимает POST от Telegram и кладет обновления в
+    application.update_queue.
+
+    Telegram держит соединение открытым (keep-alive), поэтому одно
+    соединение обслуживает много запросов. Каждый запрос (вместе с
+    ожиданием его начала) должен уложиться в request_timeout, заголовков
+    не больше max_headers и max_header_bytes в сумме. Путь, метод и
+    секрет (заголовок X-Telegram-Bot-Api-Secret-Token) проверяются до
+    чтения тела.
+    """
+
+    def __init__(self, application, path: str, secret: str, max_body: int = 1 << 20,
+                 request_timeout: float = 30.0, max_headers: int = 64, max_header_bytes: int = 16384):
+        if not secret:
+            # Без секрета любой, кто знает адрес, может подделать нажатие кнопки
+            raise ValueError('Webhook без секрета не запускается')
+        self.application = application
+        self.path = path
+        self.secret = secret.encode()
+        self.max_body = max_body
+        self.request_timeout = request_timeout
+        self.max_headers = max_headers
+        self.max_header_bytes = max_header_bytes
+        self.server = None
+        # Открытые соединения (задача -> writer): закрываются вместе с сервером
+        self._connections = {}
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self, host: str, port: int, ssl_context=None):
+        self.server = await asyncio.start_server(self._serve, host, port, ssl=ssl_context)
+        scheme = 'https' if ssl_context else 'http'
+        logger.info(f"Webhook слушает {scheme}://{host}:{port}{self.path}")
+
+    async def close(self):
+        if self.server is None:
+            return
+        self.server.close()
+        self.server = None
+        # Закрытое соединение завершает ожидающий readline() без отмены задачи
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        logger.info(f"Webhook остановлен, принято {self.received}, отклонено {self.rejected}")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    status = await asyncio.wait_for(self._handle_request(reader), self.request_timeout)
+                except asyncio.TimeoutError:
+                    status = 408
+                if status is None:
+                    break
+                writer.write(_RESPONSES[status])
+                await writer.drain()
+                if status != 200:
+                    self.rejected += 1
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader):
+        """Читает один запрос; возвращает HTTP-статус ответа или None, если соединение закрыто"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return 400
+
+        headers = {}
+        header_count = header_bytes = 0
+        while True:
+            line = await reader.readline()
+            if not line:
+                return None
+            if line in (b'\r\n', b'\n'):
+                break
+            header_count += 1
+            header_bytes += len(line)
+            if header_count > self.max_headers or header_bytes > self.max_header_bytes:
+                return 431
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # Тело читается только у запроса от Telegram
+        if target.split('?', 1)[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if not hmac.compare_digest(
+                headers.get(SECRET_HEADER, '').encode('latin-1'), self.secret):
+            logger.warning("Webhook: запрос с неверным секретом отклонен", extra={'event': 'auth_denied'})
+            return 403
+
+        length = int(headers.get('content-length', 0) or 0)
+        if length < 0 or length > self.max_body:
+            return 413
+        body = await reader.readexactly(length)
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Webhook: некорректное обновление: {e}")
+            return 400
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return 200
@@ -1,65 +1,344 @@
+import argparse
+import asyncio
+import random
+import select
 import socket
+import sys
+import time
+from collections import namedtuple
 
-def send_wol(mac_address: str, broadcast_ip: str = "192.168.50.255"):
-    # Удаляем разделители из MAC-адреса
-    mac_address = mac_address.replace(":", "").replace("-", "").lower()
-    if len(mac_address) != 12:
-        raise ValueError("Неверный MAC-адрес. Ожидается 12 символов (6 байт).")
+from heartbeat import decode_binary, KIND_ACK
 
-    # Создание magic packet
-    mac_bytes = bytes.fromhex(mac_address)
-    magic_packet = b'\xff' * 6 + mac_bytes * 16
-    # Отправка UDP broadcast
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.sendto(magic_packet, (broadcast_ip, 9))
+WOL_PORT = 9  # Стандартный порт для Wake-on-LAN
 
-    print(f"✅🚀 WOL пакет отправлен на {mac_address.upper()} через {broadcast_ip}")
- 
+# Команды и их магические префиксы (6 одинаковых байт перед 16 копиями MAC-адреса)
+COMMAND_WOL = 'wol'
+COMMAND_OFF = 'off'
+COMMAND_SLEEP = 'sleep'
+COMMAND_PREFIXES = {
+    COMMAND_WOL: b'\xff',
+    COMMAND_OFF: b'\x00',
+    COMMAND_SLEEP: b'\x99',
+}
 
-def send_off(mac_address: str, broadcast_ip: str = "192.168.50.255"):
-    # 
+
+# Итог отправки с подтверждением: acked, задержка до подтверждения (с), число повторов, id команды
+Delivery = namedtuple('Delivery', 'acked latency retries cmd_id')
+
+
+def mac_to_bytes(mac_address: str) -> bytes:
+    """
+    Преобразует MAC-адрес с любыми разделителями в 6 байт
+
+    Args:
+        mac_address (str): MAC-адрес в формате XX:XX:XX:XX:XX:XX или XX-XX-XX-XX-XX-XX
+
+    Returns:
+        bytes: MAC-адрес в виде 6 байт
+
+    Raises:
+        ValueError: Если MAC-адрес не состоит из 12 шестнадцатеричных символов
+    """
     mac_address = mac_address.replace(":", "").replace("-", "").lower()
     if len(mac_address) != 12:
         raise ValueError("Неверный MAC-адрес. Ожидается 12 символов (6 байт).")
+    return bytes.fromhex(mac_address)
+
+
+def build_packet(mac_address: str, command: str) -> bytes:
+    """
+    Собирает magic packet команды:
+    - 6 байт префикса команды (0xFF - включение, 0x00 - выключение, 0x99 - сон)
+    - 16 повторений MAC-адреса (96 байт)
+
+    Args:
+        mac_address (str): MAC-адрес ПК
+        command (str): COMMAND_WOL, COMMAND_OFF или COMMAND_SLEEP
+
+    Returns:
+        bytes: Пакет длиной 102 байта
+    """
+    return COMMAND_PREFIXES[command] * 6 + mac_to_bytes(mac_address) * 16
 
-    # Создание magic packet
-    mac_bytes = bytes.fromhex(mac_address)
-    # Создаем magic packet для выключения компьютера:
-    # - 6 байт 0x00 (магическая последовательность для выключения)
-    # - 16 повторений MAC-адреса (96 байт) - аналогично WoL, но с другим магическим числом
-    magic_packet = b'\x00' * 6 + mac_bytes * 16
 
-    # Отправка UDP broadcast
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.sendto(magic_packet, (broadcast_ip, 9))
+class WolSender:
+    """
+    Отправитель командных пакетов с одним постоянным broadcast-сокетом.
 
+    Готовые пакеты кэшируются по (MAC, команда), поэтому повторная
+    отправка - это только sendto. Сокет неблокирующий: send_async
+    отправляет через event loop и никогда не блокирует его, синхронный
+    send подходит для скриптов и CLI.
+    """
+
+    def __init__(self, port: int = WOL_PORT):
+        self.port = port
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._sock.setblocking(False)
+        self._packets = {}
+        # Ожидающие подтверждения: id команды -> future
+        self._acks = {}
+        self._loop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self._sock.fileno())
+            self._loop = None
+        self._sock.close()
+
+    def packet(self, mac_address: str, command: str) -> bytes:
+        """Возвращает готовый пакет команды из кэша, собирая его при первом обращении"""
+        key = (mac_address, command)
+        packet = self._packets.get(key)
+        if packet is None:
+            packet = self._packets[key] = build_packet(mac_address, command)
+        return packet
+
+    def send(self, mac_address: str, command: str, broadcast_ip: str = "192.168.50.255"):
+        """
+        Синхронно отправляет команду
+
+        Args:
+            mac_address (str): MAC-адрес ПК
+            command (str): COMMAND_WOL, COMMAND_OFF или COMMAND_SLEEP
+            broadcast_ip (str): Broadcast IP адрес
+        """
+        packet = self.packet(mac_address, command)
+        try:
+            self._sock.sendto(packet, (broadcast_ip, self.port))
+        except BlockingIOError:
+            # Буфер отправки полон - ждем, пока сокет станет доступен для записи
+            select.select([], [self._sock], [], 1.0)
+            self._sock.sendto(packet, (broadcast_ip, self.port))
+
+    async def send_async(self, mac_address: str, command: str, broadcast_ip: str = "192.168.50.255"):
+        """
+        Отправляет команду через event loop, не блокируя его
+
+        Args:
+            mac_address (str): MAC-адрес ПК
+            command (str): COMMAND_WOL, COMMAND_OFF или COMMAND_SLEEP
+            broadcast_ip (str): Broadcast IP адрес
+        """
+        packet = self.packet(mac_address, command)
+        loop = asyncio.get_running_loop()
+        await loop.sock_sendto(self._sock, packet, (broadcast_ip, self.port))
+
+    async def send_acked(self, mac_address: str, command: str, broadcast_ip: str = "192.168.50.255",
+                         timeout: float = 3.0, initial_delay: float = 0.1, max_delay: float = 1.0) -> Delivery:
+        """
+        Отправляет команду с подтверждением: пакет с id команды повторяется
+        с экспоненциально растущей паузой и случайным разбросом, пока агент
+        не ответит подтверждением или не истечет timeout
+
+        Args:
+            mac_address (str): MAC-адрес ПК
+            command (str): COMMAND_OFF или COMMAND_SLEEP (включение подтверждать некому)
+            broadcast_ip (str): Broadcast IP адрес
+            timeout (float): Сколько секунд ждать подтверждения
+            initial_delay (float): Пауза перед первым повтором, с
+            max_delay (float): Наибольшая пауза между повторами, с
+
+        Returns:
+            Delivery: Итог отправки
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+            loop.add_reader(self._sock.fileno(), self._on_readable)
+
+        # Случайный id: после перезапуска бота агент не примет новую команду за повтор
+        cmd_id = random.getrandbits(32)
+        while cmd_id in self._acks:
+            cmd_id = random.getrandbits(32)
+        packet = self.packet(mac_address, command) + cmd_id.to_bytes(4, 'big')
+        acked = self._acks[cmd_id] = loop.create_future()
+
+        started = loop.time()
+        deadline = started + timeout
+        delay = initial_delay
+        retries = 0
+        try:
+            while True:
+                await loop.sock_sendto(self._sock, packet, (broadcast_ip, self.port))
+                # Половина паузы фиксирована, половина случайна: повторы разных команд не совпадают
+                wait = min(delay / 2 + random.uniform(0, delay / 2), deadline - loop.time())
+                if wait <= 0:
+                    return Delivery(False, None, retries, cmd_id)
+                try:
+                    await asyncio.wait_for(asyncio.shield(acked), wait)
+                    return Delivery(True, loop.time() - started, retries, cmd_id)
+                except asyncio.TimeoutError:
+                    pass
+                if loop.time() >= deadline:
+                    return Delivery(False, None, retries, cmd_id)
+                retries += 1
+                delay = min(delay * 2, max_delay)
+        finally:
+            del self._acks[cmd_id]
+
+    def _on_readable(self):
+        # Подтверждения приходят на тот же сокет, с которого ушла команда
+        while True:
+            try:
+                data, _ = self._sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            ack = decode_binary(data)
+            if ack is None or ack.kind != KIND_ACK:
+                continue
+            future = self._acks.get(ack.seq)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    def send_bulk(self, mac_addresses, command: str = COMMAND_WOL, broadcast_ip: str = "192.168.50.255",
+                  interval: float = 0.0, copies: int = 1, copy_gap: float = 0.0) -> dict:
+        """
+        Отправляет команду группе ПК из одного сокета с заданным темпом
+
+        Args:
+            mac_addresses (list): MAC-адреса ПК
+            command (str): COMMAND_WOL, COMMAND_OFF или COMMAND_SLEEP
+            broadcast_ip (str): Broadcast IP адрес
+            interval (float): Пауза между ПК в секундах (растягивает пусковой ток при включении)
+            copies (int): Сколько копий пакета отправить каждому ПК (на случай потерь)
+            copy_gap (float): Пауза между копиями для одного ПК в секундах
+
+        Returns:
+            dict: Итоги отправки (см. _bulk_result)
+        """
+        schedule = _bulk_schedule(mac_addresses, interval, copies, copy_gap)
+        started = time.monotonic()
+        for offset, mac_address in schedule:
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.send(mac_address, command, broadcast_ip)
+        return _bulk_result(mac_addresses, schedule, time.monotonic() - started)
+
+    async def send_bulk_async(self, mac_addresses, command: str = COMMAND_WOL, broadcast_ip: str = "192.168.50.255",
+                              interval: float = 0.0, copies: int = 1, copy_gap: float = 0.0) -> dict:
+        """То же, что send_bulk, но без блокировки event loop"""
+        schedule = _bulk_schedule(mac_addresses, interval, copies, copy_gap)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for offset, mac_address in schedule:
+            delay = started + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.send_async(mac_address, command, broadcast_ip)
+        return _bulk_result(mac_addresses, schedule, loop.time() - started)
+
+
+def _bulk_schedule(mac_addresses, interval: float, copies: int, copy_gap: float) -> list:
+    # Время отправки каждой копии относительно начала: ПК i стартует в i * interval
+    schedule = [
+        (index * interval + copy * copy_gap, mac_address)
+        for index, mac_address in enumerate(mac_addresses)
+        for copy in range(copies)
+    ]
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+def _bulk_result(mac_addresses, schedule: list, elapsed: float) -> dict:
+    return {
+        'targets': len(mac_addresses),
+        'packets': len(schedule),
+        'elapsed': elapsed,
+        'packets_per_second': len(schedule) / elapsed if elapsed > 0 else float('inf'),
+    }
+
+
+def read_mac_file(path: str) -> list:
+    """
+    Читает список MAC-адресов из файла: один адрес в строке,
+    пустые строки и комментарии после '#' пропускаются
+
+    Args:
+        path (str): Путь к файлу
+
+    Returns:
+        list: MAC-адреса в порядке следования в файле
+
+    Raises:
+        ValueError: Если в файле есть неверный MAC-адрес
+    """
+    mac_addresses = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            mac_address = line.split()[0]
+            try:
+                mac_to_bytes(mac_address)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: {e}") from None
+            mac_addresses.append(mac_address)
+    return mac_addresses
+
+
+# Общий отправитель для функций send_wol/send_off/send_sleep
+_default_sender = None
+
+
+def get_default_sender() -> WolSender:
+    global _default_sender
+    if _default_sender is None:
+        _default_sender = WolSender()
+    return _default_sender
+
+
+def send_wol(mac_address: str, broadcast_ip: str = "192.168.50.255"):
+    get_default_sender().send(mac_address, COMMAND_WOL, broadcast_ip)
+    print(f"✅🚀 WOL пакет отправлен на {mac_address.upper()} через {broadcast_ip}")
+ 
+
+def send_off(mac_address: str, broadcast_ip: str = "192.168.50.255"):
+    get_default_sender().send(mac_address, COMMAND_OFF, broadcast_ip)
     print(f"✅⚫️ OFF пакет отправлен на {mac_address.upper()} через {broadcast_ip}")
  
 def send_sleep(mac_address: str, broadcast_ip: str = "192.168.50.255"):
-    # 
-    mac_address = mac_address.replace(":", "").replace("-", "").lower()
-    if len(mac_address) != 12:
-        raise ValueError("Неверный MAC-адрес. Ожидается 12 символов (6 байт).")
+    get_default_sender().send(mac_address, COMMAND_SLEEP, broadcast_ip)
+    print(f"✅🛏️ Sleep пакет отправлен на {mac_address.upper()} через {broadcast_ip}")
+ 
 
-    # Создание magic packet
-    mac_bytes = bytes.fromhex(mac_address)
-    # Создаем magic packet для выключения компьютера:
-    # - 6 байт 0x99 (магическая последовательность для сна)
-    # - 16 повторений MAC-адреса (96 байт) - аналогично WoL, но с другим магическим числом
-    magic_packet = b'\x99' * 6 + mac_bytes * 16
 
-    # Отправка UDP broadcast
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.sendto(magic_packet, (broadcast_ip, 9))
+def bulk_main(argv=None):
+    """CLI массовой отправки: python wol.py bulk macs.txt [опции]"""
+    parser = argparse.ArgumentParser(prog='wol.py bulk', description='Массовая отправка команд ПК')
+    parser.add_argument('mac_file', help='Файл со списком MAC-адресов (по одному в строке)')
+    parser.add_argument('--broadcast', default="192.168.50.255", help='Broadcast IP адрес')
+    parser.add_argument('--command', choices=sorted(COMMAND_PREFIXES), default=COMMAND_WOL)
+    parser.add_argument('--interval', type=float, default=0.0, help='Пауза между ПК, с')
+    parser.add_argument('--copies', type=int, default=1, help='Копий пакета на ПК')
+    parser.add_argument('--copy-gap', type=float, default=0.0, help='Пауза между копиями, с')
+    parser.add_argument('--port', type=int, default=WOL_PORT)
+    args = parser.parse_args(argv)
 
-    print(f"✅🛏️ Sleep пакет отправлен на {mac_address.upper()} через {broadcast_ip}")
- 
+    mac_addresses = read_mac_file(args.mac_file)
+    with WolSender(args.port) as sender:
+        result = sender.send_bulk(mac_addresses, args.command, args.broadcast,
+                                  args.interval, args.copies, args.copy_gap)
+    print(f"✅ {result['packets']} пакетов ({args.command}) отправлено на {result['targets']} ПК "
+          f"за {result['elapsed']:.3f} с, {result['packets_per_second']:.0f} пакетов/с")
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'bulk':
+        bulk_main(sys.argv[2:])
+        sys.exit()
+
     while True:
         print('Выберите пункт меню:')
         print('1. Включение ПК')